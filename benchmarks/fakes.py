@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Local stand-ins for the Docker Engine API and a registry, used by the benchmarks """
+
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+def digest(text: str) -> str:
+    """ returns a fake, but stable, sha256 digest for the text """
+    return f"sha256:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class FakeServer():
+    """ Runs a `ThreadingHTTPServer` in the background and counts the handled requests by route """
+    routes = []
+
+    def __init__(self):
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        # the headers of the request handled by the current thread
+        self.request = threading.local()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ dispatches the requests to the routes of the fake """
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                """ finds the route, counts the call and sends the response """
+                url = urlparse(self.path)
+                for method, pattern, name in fake.routes:
+                    match = re.fullmatch(pattern, url.path)
+                    if method == self.command and match:
+                        with fake.lock:
+                            fake.calls[name] += 1
+                        length = int(self.headers.get('Content-Length', 0))
+                        body = json.loads(self.rfile.read(length)) if length else None
+                        fake.request.headers = self.headers
+                        status, headers, payload = getattr(fake, name)(match, parse_qs(url.query), body)
+                        break
+                else:
+                    status, headers, payload = 404, {}, {'message': f'{self.command} {url.path} not found'}
+
+                data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_HEAD = handle_request
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self.start()
+
+    def start(self):
+        """ serves the requests in a background thread """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """ stops the server """
+        self.server.shutdown()
+
+
+class FakeRegistry(FakeServer):
+    """
+    Answers `HEAD /v2/<name>/manifests/<tag>` after `latency` seconds. A share of `error_rate` requests fails with
+    HTTP 500 and a share of `churn` images has a different digest than the one the services run. The manifests have an
+    `ETag` and `If-None-Match` is answered with HTTP 304.
+    """
+    routes = [
+        ('HEAD', r'/v2/(?P<name>.+)/manifests/(?P<tag>[^/]+)', 'manifest'),
+    ]
+
+    def __init__(self, latency: float = 0.01, error_rate: float = 0, churn: float = 0.1, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.churn = churn
+        self.random = random.Random(seed)
+        super().__init__()
+
+    @property
+    def host(self) -> str:
+        """ the registry host, as used in the image references """
+        return f'127.0.0.1:{self.port}'
+
+    def current_digest(self, repository: str) -> str:
+        """ returns the digest the registry reports for the repository """
+        churned = int(hashlib.sha256(repository.encode('utf-8')).hexdigest(), 16) % 1000 < self.churn * 1000
+        return digest(f'{repository}:new' if churned else repository)
+
+    def lookup(self, repository: str):
+        """ simulates a lookup and returns the digest or `None` on error """
+        time.sleep(self.latency)
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+        return None if failed else self.current_digest(repository)
+
+    def manifest(self, match, query, body):  # pylint: disable=unused-argument
+        """ HEAD /v2/<name>/manifests/<tag> """
+        found = self.lookup(match['name'])
+        if not found:
+            return 500, {}, None
+        etag = f'"{found}"'
+        if self.request.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, None
+        return 200, {'Docker-Content-Digest': found, 'ETag': etag}, None
+
+
+@dataclass
+class AccessPolicy():
+    """
+    What the `GuardedRegistry` requires. With `auth='basic'` or `auth='bearer'`, the manifests require the
+    `credentials` (username, password), directly or through a token from `GET /token` that is valid for `token_ttl`
+    seconds. After `rate_limit` manifest requests, the registry answers with HTTP 429 and `Retry-After: <retry_after>`.
+    """
+    auth: str = None
+    credentials: tuple = ('cioban', 'secret')
+    token_ttl: int = 60
+    rate_limit: int = 0
+    retry_after: int = 30
+
+    @property
+    def basic(self) -> str:
+        """ the `Authorization` header with the credentials """
+        return 'Basic ' + base64.b64encode(':'.join(self.credentials).encode('utf-8')).decode('utf-8')
+
+
+class GuardedRegistry(FakeRegistry):
+    """ A `FakeRegistry` with the authentication and the rate limit of the `policy` """
+    routes = FakeRegistry.routes + [
+        ('GET', r'/token', 'token'),
+    ]
+
+    def __init__(self, policy: AccessPolicy, **kwargs):
+        self.policy = policy
+        # the issued tokens, with the time they expire
+        self.tokens = {}
+        super().__init__(**kwargs)
+
+    def authorized(self) -> bool:
+        """ checks the `Authorization` header of the current request """
+        authorization = self.request.headers.get('Authorization', '')
+        if self.policy.auth == 'basic':
+            return authorization == self.policy.basic
+        if self.policy.auth == 'bearer':
+            with self.lock:
+                expires = self.tokens.get(authorization[len('Bearer '):])
+            return bool(expires and expires > time.monotonic())
+        return True
+
+    def challenge(self, name: str) -> str:
+        """ returns the `WWW-Authenticate` header """
+        if self.policy.auth == 'basic':
+            return 'Basic realm="fake"'
+        return f'Bearer realm="http://{self.host}/token",service="fake",scope="repository:{name}:pull"'
+
+    def manifest(self, match, query, body):
+        """ HEAD /v2/<name>/manifests/<tag>, once the rate limit and the authentication allow it """
+        if self.policy.rate_limit and self.calls['manifest'] > self.policy.rate_limit:
+            return 429, {'Retry-After': str(self.policy.retry_after)}, None
+        if not self.authorized():
+            return 401, {'WWW-Authenticate': self.challenge(match['name'])}, None
+        return super().manifest(match, query, body)
+
+    def token(self, match, query, body):  # pylint: disable=unused-argument
+        """ GET /token, with the credentials as basic authentication """
+        if self.request.headers.get('Authorization') != self.policy.basic:
+            return 401, {}, None
+        with self.lock:
+            token = f'token-{len(self.tokens) + 1}'
+            self.tokens[token] = time.monotonic() + self.policy.token_ttl
+        return 200, {}, {'token': token, 'expires_in': self.policy.token_ttl}
+
+
+class FakeEngine(FakeServer):
+    """
+    Serves the subset of the Docker Engine API used by cioban, for `services` swarm services. The services use
+    `images` distinct images from the `registry`. Updated services are `updating` for `converge` seconds.
+    """
+    api_version = '1.45'
+    routes = [
+        ('GET', r'/version', 'version'),
+        ('GET', r'/v[\d.]+/services', 'services_list'),
+        ('GET', r'/v[\d.]+/services/(?P<id>[^/]+)', 'services_inspect'),
+        ('POST', r'/v[\d.]+/services/(?P<id>[^/]+)/update', 'services_update'),
+        ('GET', r'/v[\d.]+/distribution/(?P<name>.+)/json', 'distribution'),
+    ]
+
+    def __init__(self, registry: FakeRegistry, services: int = 10, images: int = 10, converge: float = 0):
+        self.registry = registry
+        self.converge = converge
+        self.services = {}
+        self.updated = {}
+        for i in range(services):
+            service_id = hashlib.sha256(f'service{i}'.encode('utf-8')).hexdigest()[:25]
+            repository = f'bench/image{i % images}'
+            self.services[service_id] = {
+                'ID': service_id,
+                'Version': {'Index': 1},
+                'Spec': {
+                    'Name': f'bench_service{i}',
+                    'Labels': {'ai.ix.auto-update': 'true'},
+                    'TaskTemplate': {
+                        'ContainerSpec': {'Image': f'{registry.host}/{repository}:latest@{digest(repository)}'},
+                        'ForceUpdate': 0,
+                    },
+                    'Mode': {'Replicated': {'Replicas': 1}},
+                },
+            }
+        super().__init__()
+
+    def version(self, match, query, body):  # pylint: disable=unused-argument
+        """ GET /version """
+        return 200, {}, {'ApiVersion': self.api_version, 'Version': 'fake'}
+
+    def services_list(self, match, query, body):  # pylint: disable=unused-argument
+        """ GET /services """
+        with self.lock:
+            return 200, {}, [self.__status(service) for service in self.services.values()]
+
+    def services_inspect(self, match, query, body):  # pylint: disable=unused-argument
+        """ GET /services/<id> """
+        with self.lock:
+            service = self.services.get(match['id'])
+            if not service:
+                return 404, {}, {'message': f"service {match['id']} not found"}
+            return 200, {}, self.__status(service)
+
+    def services_update(self, match, query, body):
+        """ POST /services/<id>/update """
+        with self.lock:
+            service = self.services.get(match['id'])
+            if not service:
+                return 404, {}, {'message': f"service {match['id']} not found"}
+            if int(query.get('version', ['0'])[0]) != service['Version']['Index']:
+                return 500, {}, {'message': 'update out of sequence'}
+            service['Spec'] = body
+            service['Version']['Index'] += 1
+            self.updated[match['id']] = time.monotonic()
+            return 200, {}, {'Warnings': None}
+
+    def distribution(self, match, query, body):  # pylint: disable=unused-argument
+        """ GET /distribution/<name>/json, resolved through the fake registry """
+        repository = unquote(match['name']).split('/', 1)[1].rsplit(':', 1)[0]
+        found = self.registry.lookup(repository)
+        if not found:
+            return 500, {}, {'message': 'registry error'}
+        return 200, {}, {'Descriptor': {'digest': found, 'mediaType': 'application/vnd.oci.image.index.v1+json'}}
+
+    def __status(self, service: dict) -> dict:
+        """ returns the service with its current `UpdateStatus` """
+        updated = self.updated.get(service['ID'])
+        if updated is None:
+            return service
+        state = 'updating' if time.monotonic() - updated < self.converge else 'completed'
+        return {**service, 'UpdateStatus': {'State': state}}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks the direct registry client against the fake registry: anonymous, basic and bearer authentication, the token
+cache, `If-None-Match` and the rate limit. Exits with `1` if a check fails.
+
+    python3 -m benchmarks.registry
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+from cioban.lib.ratelimit import RegistryThrottle
+from cioban.lib.registry import RegistryClient, RegistryError, RegistryRateLimited
+from .fakes import AccessPolicy, FakeRegistry, GuardedRegistry
+
+
+def client_for(registry: FakeRegistry, directory: str, **kwargs) -> RegistryClient:
+    """ returns a client with the credentials of the fake registry in its docker config file """
+    config_path = os.path.join(directory, f'config-{registry.port}.json')
+    auth = base64.b64encode(b'cioban:secret').decode('utf-8')
+    with open(config_path, 'w', encoding='utf-8') as config_file:
+        json.dump({'auths': {registry.host: {'auth': auth}}}, config_file)
+    return RegistryClient(config_path=config_path, insecure_registries=[registry.host], **kwargs)
+
+
+def check_anonymous(directory: str) -> dict:
+    """ a registry without authentication, with the ETag of the manifest sent back """
+    registry = FakeRegistry(latency=0)
+    client = client_for(registry, directory)
+    image = f'{registry.host}/bench/anonymous:latest'
+    first = client.get_digest(image)
+    second = client.get_digest(image)
+    return {
+        'digest': first == registry.current_digest('bench/anonymous'),
+        'not modified': second == first and registry.calls['manifest'] == 2,
+        'no token': registry.calls['token'] == 0,
+    }
+
+
+def check_basic(directory: str) -> dict:
+    """ a registry with basic authentication, answering the challenge with the configured credentials """
+    registry = GuardedRegistry(AccessPolicy(auth='basic'), latency=0)
+    client = client_for(registry, directory)
+    image = f'{registry.host}/bench/basic:latest'
+    first = client.get_digest(image)
+    calls = registry.calls['manifest']
+    client.get_digest(image)
+    cached = registry.calls['manifest'] == calls + 1
+    anonymous = RegistryClient(insecure_registries=[registry.host])
+    try:
+        anonymous.get_digest(image)
+        refused = False
+    except RegistryError:
+        refused = True
+    return {
+        'digest': first == registry.current_digest('bench/basic'),
+        'challenge answered': calls == 2,
+        'header cached': cached,
+        'no credentials refused': refused,
+    }
+
+
+def check_bearer(directory: str) -> dict:
+    """ a registry with bearer tokens, which are cached until shortly before they expire """
+    registry = GuardedRegistry(AccessPolicy(auth='bearer', token_ttl=6), latency=0)
+    client = client_for(registry, directory)
+    image = f'{registry.host}/bench/bearer:latest'
+    first = client.get_digest(image)
+    client.get_digest(image)
+    cached = registry.calls['token'] == 1
+    # the client renews the token 5 seconds before it expires
+    time.sleep(1.1)
+    client.get_digest(image)
+    return {
+        'digest': first == registry.current_digest('bench/bearer'),
+        'token cached': cached,
+        'token renewed': registry.calls['token'] == 2,
+    }
+
+
+def check_rate_limit(directory: str) -> dict:
+    """ a registry answering with HTTP 429 and `Retry-After` after two requests """
+    registry = GuardedRegistry(AccessPolicy(rate_limit=2, retry_after=42), latency=0)
+    throttle = RegistryThrottle()
+    client = client_for(registry, directory, throttle=throttle)
+    results = {}
+    for tag in ('1', '2', '3'):
+        try:
+            client.get_digest(f'{registry.host}/bench/limited:{tag}')
+        except RegistryRateLimited as error:
+            results['retry after'] = error.retry_after == 42
+            results['paused'] = abs(throttle.pause(registry.host, error.retry_after) - time.time() - 42) < 1
+    results['limited on the third'] = registry.calls['manifest'] == 3 and 'retry after' in results
+    return results
+
+
+def main() -> int:
+    """ runs the checks and prints the results """
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for check in (check_anonymous, check_basic, check_bearer, check_rate_limit):
+            name = check.__name__[len('check_'):]
+            try:
+                results = check(directory)
+            except Exception as e:  # pylint: disable=broad-except
+                results = {f'raised {e!r}': False}
+            for description, passed in results.items():
+                failed += not passed
+                print(f"{'ok  ' if passed else 'FAIL'} {name}: {description}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks `Cioban.get_services()` and `Cioban._run()` against a fake Docker Engine API and a fake registry.
+
+Every scenario runs in its own process, so the peak RSS belongs to that scenario only. Examples:
+
+    python3 -m benchmarks.run
+    python3 -m benchmarks.run --services 500 --shared 0.9 --latency 0.05 --set check_workers=8
+    python3 -m benchmarks.run --json > before.jsonl
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from .fakes import FakeEngine, FakeRegistry
+
+PHASES = ['inventory', 'check', 'update', 'convergence', 'webhook', 'notify']
+DEFAULT_SCENARIOS = [
+    (10, 0),
+    (500, 0),
+    (500, 0.9),
+    (5000, 0.9),
+    (5000, 0.99),
+]
+
+
+def parse_settings(values: list) -> dict:
+    """ converts `key=value` pairs to cioban settings, using the same types as the environment variables """
+    settings = {}
+    for value in values:
+        key, setting = value.split('=', 1)
+        try:
+            settings[key] = int(setting)
+        except ValueError:
+            settings[key] = setting.split(' ') if ' ' in setting else setting
+    return settings
+
+
+def run_scenario(args) -> dict:
+    """ runs a single scenario in this process and returns the results """
+    images = max(1, int(args.services * (1 - args.shared)))
+    registry = FakeRegistry(latency=args.latency, error_rate=args.error_rate, churn=args.churn)
+    engine = FakeEngine(registry, services=args.services, images=images, converge=args.converge)
+
+    # cioban connects to the docker daemon from the environment, so it has to be set up before the import
+    os.environ['DOCKER_HOST'] = f'tcp://127.0.0.1:{engine.port}'
+    os.environ.setdefault('LOGLEVEL', 'ERROR')
+    started = time.perf_counter()
+    from cioban import cioban  # pylint: disable=import-outside-toplevel
+    imported = time.perf_counter() - started
+    from prometheus_client import REGISTRY  # pylint: disable=import-outside-toplevel
+
+    settings = {'insecure_registries': [registry.host], **parse_settings(args.set)}
+    c = cioban.Cioban(**settings)
+    engine.calls.clear()
+
+    started = time.perf_counter()
+    c.get_services()
+    inventory = time.perf_counter() - started
+    started = time.perf_counter()
+    c._run()  # pylint: disable=protected-access
+    run = time.perf_counter() - started
+
+    registry_calls = engine.calls['distribution'] + sum(registry.calls.values())
+    phases = {}
+    for phase in PHASES:
+        phases[phase] = REGISTRY.get_sample_value('update_phase_seconds_sum', {'phase': phase}) or 0
+
+    return {
+        'services': args.services,
+        'images': images,
+        'settings': settings,
+        'import_seconds': round(imported, 4),
+        'startup_seconds': round(REGISTRY.get_sample_value('cioban_startup_seconds') or 0, 4),
+        'get_services_seconds': round(inventory, 4),
+        'run_seconds': round(run, 4),
+        'daemon_calls': dict(engine.calls),
+        'registry_calls': registry_calls,
+        'updated': len(engine.updated),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'phases': {phase: round(seconds, 4) for phase, seconds in phases.items()},
+    }
+
+
+def print_table(results: list):
+    """ prints the results of all the scenarios """
+    header = f"{'services':>8} {'images':>7} {'start s':>8} {'list s':>8} {'run s':>8} {'daemon':>7} {'registry':>8} "
+    header += f"{'updated':>7} "
+    header += f"{'rss MB':>7}  phases (s)"
+    print(header)
+    for result in results:
+        phases = ' '.join(f'{phase}={seconds}' for phase, seconds in result['phases'].items() if seconds)
+        print(
+            f"{result['services']:>8} {result['images']:>7} {result['startup_seconds']:>8} "
+            f"{result['get_services_seconds']:>8} "
+            f"{result['run_seconds']:>8} {sum(result['daemon_calls'].values()):>7} {result['registry_calls']:>8} "
+            f"{result['updated']:>7} {result['peak_rss_kb'] / 1024:>7.1f}  {phases}"
+        )
+
+
+def main():
+    """ runs the scenarios, each one in a separate process """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', type=int, help='Number of services. Runs the default scenarios if unset')
+    parser.add_argument('--shared', type=float, default=0, help='Share of services reusing an image (0 to 1)')
+    parser.add_argument('--latency', type=float, default=0.01, help='Registry latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of failed registry lookups (0 to 1)')
+    parser.add_argument('--churn', type=float, default=0.1, help='Share of images with a new digest (0 to 1)')
+    parser.add_argument('--converge', type=float, default=0, help='Seconds an updated service stays `updating`')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='A cioban setting')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON lines')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    scenarios = [(args.services, args.shared)] if args.services else DEFAULT_SCENARIOS
+    results = []
+    for services, shared in scenarios:
+        command = [sys.executable, '-m', 'benchmarks.run', '--single', '--services', str(services)]
+        command += ['--shared', str(shared), '--latency', str(args.latency), '--error-rate', str(args.error_rate)]
+        command += ['--churn', str(args.churn), '--converge', str(args.converge)]
+        for setting in args.set:
+            command += ['--set', setting]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        if args.json:
+            print(output.strip().splitlines()[-1], flush=True)
+
+    if not args.json:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,13 @@
 """ sets the logging defaults for cioban """
 
 import os
-from .lib import log as logging
-from .lib import constants
+import time
+
+# the start of cioban, for measuring the time until the first check
+STARTED = time.monotonic()
+
+from .lib import log as logging  # pylint: disable=wrong-import-position
+from .lib import constants  # pylint: disable=wrong-import-position
 
 version = f'{constants.VERSION}-{constants.BUILD}'
 log = logging.setup_logger(
@@ -12,6 +17,7 @@ log = logging.setup_logger(
     level=os.environ.get('LOGLEVEL', 'INFO'),
     gelf_host=os.environ.get('GELF_HOST'),
     gelf_port=int(os.environ.get('GELF_PORT', 12201)),
+    dedup_window=int(os.environ.get('LOG_DEDUP_WINDOW', 0)),
     _ix_id=__package__,
     _version=version,
 )
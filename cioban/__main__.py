@@ -3,6 +3,7 @@
 """ processes the environment variables and starts cioban """
 
 import logging
+import sys
 from . import cioban
 from .lib import helpers
 from .lib import constants
@@ -18,6 +19,10 @@ if options.get('gotify_url') and options.get('gotify_token'):
 
 c = cioban.Cioban(**options)
 
+if options.get('run_once'):
+    log.warning(f"Starting {__package__} {version} for a single run")
+    sys.exit(c.run_once())
+
 startup_message = f"Starting **{__package__} {version}**. Exposing metrics on port {c.get_port()}"
 log.warning(startup_message)
 c.notify(title="Startup", message=startup_message)
@@ -3,24 +3,41 @@
 """ A docker swarm service for automatically updating your services to the latest image tag push. """
 
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
 import requests
 import pause
 import docker
-from prometheus_client import start_http_server
+from prometheus_client import push_to_gateway, REGISTRY
 from cronsim import CronSim, CronSimError
+from . import STARTED
 from .lib import constants
+from .lib import helpers
 from .lib import prometheus
 from .lib import notifiers
-from .lib.webhooks import Webhooks
+from .lib.digests import DigestCache, registry_limiter
+from .lib.planner import plan
+from .lib.ratelimit import RegistryThrottle, Throttled
+from .lib.registry import RegistryClient, RegistryError, RegistryRateLimited
+from .lib.rollout import Rollout, Update
+from .lib.scheduler import Scheduler
+from .lib.selector import Selector
+from .lib.state import StateStore
+from .lib.status import Status, start_server
+from .lib.swarm import Swarm, connect
+from .lib.trace import Tracer
+from .lib.webhooks import Dispatcher
 
 log = logging.getLogger('cioban')
 
 
-class Cioban():
+class Cioban():  # pylint: disable=too-many-instance-attributes
     """ The main class """
     settings = {
-        'filter_services': {},
+        'filter_services': [],
         'blacklist_services': {},
         'sleep_time': '6h',
         'schedule_time': False,
@@ -29,17 +46,54 @@ class Cioban():
         'notify_include_image': False,
         'notify_include_new_image': False,
         'notify_include_old_image': False,
+        'digest_cache_ttl': 0,
+        'digest_cache_size': 1000,
+        'check_workers': 1,
+        'registry_concurrency': 4,
+        'max_concurrent_updates': 1,
+        'update_group_concurrency': 0,
+        'update_timeout': 0,
+        'registry_client': 'docker',
+        'registry_auth_file': '/root/.docker/config.json',
+        'insecure_registries': [],
+        'inventory_events': False,
+        'inventory_resync_time': 3600,
+        'push_port': 0,
+        'push_token': None,
+        'webhook_workers': 2,
+        'webhook_queue_size': 100,
+        'notify_mode': 'immediate',
+        'notify_window': 0,
+        'notify_rate_limit': 0,
+        'notify_max_pending': 100,
+        'metrics_max_series': 0,
+        'docker_endpoints': [],
+        'schedule_jitter': 0,
+        'registry_rate_limits': [],
+        'registry_retry_after': 300,
+        'state_file': None,
+        'run_once': False,
+        'pushgateway_url': None,
+        'trace_dir': None,
+        'trace_format': 'jsonl',
+        'trace_keep': 10,
     }
-    docker = docker.from_env()
-    notifiers = notifiers.start()
+    reload_limit = 10
+    # if set, used instead of connecting to the docker daemon from the environment
+    docker = None
 
     def __init__(self, **kwargs):
         for k, v in kwargs.items():
             if k in self.settings:
                 self.settings[k] = v
             else:
-                log.debug(f'{k} not found in settings. Ignoring.')
+                log.debug('%s not found in settings. Ignoring.', k)
+        self.__notifiers = None
+        self.first_check = None
+        self.failures = []
+        self.status = Status()
         prometheus.PROM_INFO.info({'version': f'{constants.VERSION}-{constants.BUILD}'})
+        prometheus.SERVICE_SERIES.max_series = self.settings['metrics_max_series']
 
         # Test schedule_time
         if self.settings['schedule_time']:
@@ -58,23 +112,106 @@ class Cioban():
         }
 
         try:
-            self.sleep = int(self.settings['sleep_time'])
-            self.sleep_type = 'minutes'
+            sleep = int(self.settings['sleep_time'])
+            sleep_type = 'minutes'
         except ValueError as exc:
             try:
-                self.sleep = int(self.settings['sleep_time'][:-1])
+                sleep = int(self.settings['sleep_time'][:-1])
             except ValueError as e:
                 raise ValueError(f"{self.settings['sleep_time']} not understood. The error: {e}") from e
 
             if self.settings['sleep_time'][-1] in relation:
-                self.sleep_type = relation[self.settings['sleep_time'][-1]]
+                sleep_type = relation[self.settings['sleep_time'][-1]]
             else:
                 raise ValueError(f"{self.settings['sleep_time']} not understood") from exc
 
+        self.digest_cache = DigestCache(
+            ttl=self.settings['digest_cache_ttl'],
+            size=self.settings['digest_cache_size'],
+        )
+        self.swarms = self.__connect_swarms()
+        self.registry_limit = registry_limiter(self.settings['registry_concurrency'])
+        self.throttle = RegistryThrottle(
+            rates=self.settings['registry_rate_limits'],
+            retry_after=self.settings['registry_retry_after'],
+        )
+        self.deferred = {}
+        self.run_lock = threading.Lock()
+        self.webhooks = None
+        if self.settings['webhook_workers'] > 0:
+            self.webhooks = Dispatcher(
+                workers=self.settings['webhook_workers'],
+                queue_size=self.settings['webhook_queue_size'],
+            )
+        self.registry_client = self.__get_registry_client()
+        self.scheduler = Scheduler(
+            interval=timedelta(**{sleep_type: sleep}).total_seconds(),
+            schedule=self.settings['schedule_time'],
+            jitter=self.settings['schedule_jitter'],
+        )
+        self.state = None
+        if self.settings['state_file']:
+            self.state = StateStore(self.settings['state_file'])
+            self.__load_state()
+        self.tracer = Tracer(
+            directory=self.settings['trace_dir'],
+            fmt=self.settings['trace_format'],
+            keep=self.settings['trace_keep'],
+        )
+        self.rollout = Rollout(
+            max_concurrent=self.settings['max_concurrent_updates'],
+            timeout=self.settings['update_timeout'],
+            group_concurrency=self.settings['update_group_concurrency'],
+            tracer=self.tracer,
+        )
+
         self.register_notifiers(**kwargs)
 
         log.debug('Cioban initialized')
 
+    def __load_state(self):
+        """ restores the digest cache and the check times from the state file """
+        state = self.state.load()
+        self.digest_cache.restore(state.get('digests', {}))
+        self.scheduler.restore({
+            service_id: service['due'] for service_id, service in state.get('services', {}).items()
+            if service.get('due')
+        })
+
+    def __connect_swarms(self) -> list:
+        """ returns a `Swarm` for every endpoint in `DOCKER_ENDPOINTS`, or the default one """
+        # compiled once and shared by all the endpoints
+        selector = Selector(filters=self.settings['filter_services'], blacklist=self.settings['blacklist_services'])
+        if self.settings['docker_endpoints']:
+            return connect(self.settings['docker_endpoints'], selector=selector)
+        return [Swarm('default', connection=self.docker, selector=selector)]
+
+    def __get_registry_client(self):
+        """ returns the direct registry client or `None` if the digests are looked up through the docker daemon """
+        if self.settings['registry_client'] == 'direct':
+            return RegistryClient(
+                config_path=self.settings['registry_auth_file'],
+                insecure_registries=self.settings['insecure_registries'],
+                pool_size=max(self.settings['registry_concurrency'], self.settings['check_workers'], 1),
+                throttle=self.throttle,
+            )
+        if self.settings['registry_client'] != 'docker':
+            raise ValueError(f"{self.settings['registry_client']} not understood for the registry client")
+        return None
+
+    @property
+    def notifiers(self):
+        """ the notification core, started on first use """
+        if not self.__notifiers:
+            self.__notifiers = notifiers.start()
+            self.__notifiers.configure(
+                mode=self.settings['notify_mode'],
+                window=self.settings['notify_window'],
+                rate_limit=self.settings['notify_rate_limit'],
+                max_pending=self.settings['notify_max_pending'],
+            )
+        return self.__notifiers
+
     def register_notifiers(self, **kwargs):
         """
         checks in self.settings['notifiers'] for all the to be registered notifiers then look at all kwargs for any keys
@@ -94,43 +231,141 @@ class Cioban():
 
     def run(self):
         """ prepares the run and then triggers it. this is the actual loop """
-        start_http_server(self.settings['prometheus_port'])  # starts the prometheus metrics server
+        start_server(self.settings['prometheus_port'], self.status)  # starts the prometheus metrics and /status server
         log.info(f"Listening on port {self.settings['prometheus_port']}")
+        if self.settings['inventory_events']:
+            for swarm in self.swarms:
+                try:
+                    swarm.inventory.watch(swarm.client, resync=self.settings['inventory_resync_time'])
+                except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError,
+                        docker.errors.DockerException) as error:
+                    # the services of the endpoint are listed on every run instead
+                    log.error(f'Cannot follow the service events on {swarm.name}. The error: {error}')
+        if self.settings['push_port']:
+            from .lib.receiver import PushReceiver  # pylint: disable=import-outside-toplevel
+            PushReceiver(
+                port=self.settings['push_port'],
+                callback=self.update_images,
+                token=self.settings['push_token'],
+            ).start()
+        inventory_due = listed = 0
         while True:
-            self.get_services()
-            if self.settings['schedule_time']:
-                self.__set_timer()
-            log.info(f'Sleeping for {self.sleep} {self.sleep_type}')
+            # up to `reload_limit` due services are reloaded one by one, so new services are only found by listing all
+            # the services at least once per global interval. A run of more services already listed them.
+            stale = [swarm for swarm in self.swarms if not swarm.inventory.watching and swarm.listed <= listed]
+            if not stale or time.time() >= inventory_due:
+                for swarm in stale:
+                    try:
+                        self.get_services(swarm=swarm)
+                    except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError,
+                            docker.errors.DockerException) as error:
+                        # the other endpoints are still served, this one is listed again with the next run or interval
+                        log.error(f'Cannot connect to docker on {swarm.name}. The error: {error}')
+                listed = time.time()
+                inventory_due = self.scheduler.default_due()
+            self.scheduler.sync([service for swarm in self.swarms for service in swarm.inventory.selected()])
+            next_due = min(self.scheduler.next_due() or inventory_due, inventory_due)
+            log.info(f'Sleeping for {timedelta(seconds=max(int(next_due - time.time()), 0))}')
             prometheus.PROM_STATE_ENUM.state('sleeping')
-            wait = getattr(pause, self.sleep_type)
-            wait(self.sleep)
+            pause.until(next_due)
             prometheus.PROM_STATE_ENUM.state('running')
-            log.info('Starting update run')
-            self._run()
-
-    def __set_timer(self):
-        self.sleep_type = 'seconds'
-        cron_timer = CronSim(self.settings['schedule_time'], datetime.now())
-        self.sleep = (next(cron_timer) - datetime.now()).seconds + 1
-        next_run = str(timedelta(seconds = self.sleep))
-        log.debug(f"Based on the cron schedule '{self.settings['schedule_time']}', next run is in {next_run}")
-
-    def __get_updated_image(self, image, image_sha):
-        """ checks if an image has an update """
-        registry_data = None
+            service_ids = self.scheduler.pop_due()
+            log.info(f'Starting update run for {len(service_ids)} services')
+            if service_ids:
+                deferred = self._run(service_ids=service_ids)
+                self.scheduler.reschedule(service_ids - deferred.keys())
+                self.scheduler.defer(deferred)
+            self.save_state()
+
+    def run_once(self) -> int:
+        """
+        checks all the services once, without starting the metrics server
+        :return: The exit code. `0` if all the services have been checked and updated, otherwise `1`
+        """
+        log.info('Starting update run')
+        prometheus.PROM_STATE_ENUM.state('running')
+        deferred = self._run()
+        # the state file keeps only the scheduled services, so the checked services have to be scheduled
+        services = [service for swarm in self.swarms for service in swarm.inventory.selected()]
+        self.scheduler.sync(services)
+        self.scheduler.reschedule({service.id for service in services} - deferred.keys())
+        self.scheduler.defer(deferred)
+        self.save_state()
+        # the webhooks and notifications are sent in the background, they have to be out before exiting
+        if self.webhooks:
+            self.webhooks.join()
+        if self.__notifiers:
+            self.__notifiers.join()
+
+        exit_code = 0
+        if self.failures or deferred:
+            log.error(f'{len(self.failures)} failures and {len(deferred)} deferred services during the run')
+            exit_code = 1
+        if self.settings['pushgateway_url']:
+            try:
+                push_to_gateway(self.settings['pushgateway_url'], job='cioban', registry=REGISTRY)
+            except OSError as error:
+                log.error(f"Could not push the metrics to {self.settings['pushgateway_url']}. The error: {error}")
+                exit_code = 1
+        return exit_code
+
+    def save_state(self):
+        """ writes the digest cache and the check times of the services to the state file, if configured """
+        if self.state:
+            self.state.save(
+                due=self.scheduler.dump(),
+                digests=self.digest_cache.dump(),
+                next_run=self.scheduler.next_due(),
+            )
+
+    def __get_registry_digest(self, image, swarm):
+        """ retrieves the digest of an image from the registry, through the docker daemon of the checked endpoint """
+        digest = None
+        registry = helpers.parse_image(image)[0]
+        self.throttle.acquire(registry)
+        with self.registry_limit(image), prometheus.PROM_REGISTRY_LOOKUP_SECONDS.labels(registry).time(), \
+                self.tracer.span('registry', image=image, registry=registry) as span:
+            if self.registry_client:
+                try:
+                    digest = self.registry_client.get_digest(image)
+                    span.set(outcome='resolved', client='direct')
+                    return digest
+                except RegistryRateLimited as error:
+                    # the docker daemon would run into the same limit
+                    raise Throttled(registry, self.throttle.pause(registry, error.retry_after)) from error
+                except (RegistryError, requests.exceptions.RequestException) as error:
+                    prometheus.PROM_REGISTRY_ERRORS.labels(registry).inc()
+                    log.debug('The registry client failed for %s, using the docker daemon. The error: %s', image, error)
+            try:
+                # the digests are shared by all the endpoints, so the first endpoint to check the image resolves it
+                registry_data = swarm.client.images.get_registry_data(image)
+                digest = registry_data.attrs['Descriptor']['digest']
+                span.set(outcome='resolved', client='docker')
+            except (docker.errors.DockerException, requests.exceptions.RequestException) as error:
+                if self.__is_rate_limited(error):
+                    raise Throttled(registry, self.throttle.pause(registry)) from error
+                prometheus.PROM_REGISTRY_ERRORS.labels(registry).inc()
+                span.set(outcome='failed')
+                self.failures.append(image)
+                log.error(f'Failed to retrieve the registry data for {image}. The error: {error}')
+        return digest
+
+    @staticmethod
+    def __is_rate_limited(error) -> bool:
+        """ the docker daemon usually wraps the HTTP 429 of the registry in a HTTP 500 """
+        if not isinstance(error, docker.errors.APIError):
+            return False
+        return error.status_code == 429 or 'toomanyrequests' in str(error.explanation).lower()
+
+    def __get_updated_image(self, image, image_sha, digest):
+        """ checks if an image has an update, against the digest resolved from the registry """
         updated_image = None
-        try:
-            registry_data = self.docker.images.get_registry_data(image)
-        except (docker.errors.APIError, requests.exceptions.ReadTimeout) as error:
-            log.error(f'Failed to retrieve the registry data for {image}. The error: {error}')
-
-        if registry_data:
-            digest = registry_data.attrs['Descriptor']['digest']
+        if digest:
             updated_image = f'{image}@{digest}'
 
             if image_sha == digest:
                 updated_image = False
-                log.debug(f'{image}@{image_sha}: No update available')
+                log.debug('%s@%s: No update available', image, image_sha)
 
         return updated_image
 
@@ -147,107 +382,233 @@ class Cioban():
 
         return image, image_sha
 
-    def __update_image(self, service, update_image):
+    def __check_image(self, swarm, services):
+        """ resolves the image shared by the services once and returns the registry digest, if any """
+        image = swarm.inventory.details(services[0]).image
+        try:
+            with self.tracer.span('lookup', image=image, services=len(services)) as span:
+                digest = self.digest_cache.resolve(image, partial(self.__get_registry_digest, swarm=swarm))
+                span.set(outcome='resolved' if digest else 'failed')
+            return digest
+        except Throttled as throttled:
+            log.info(f'Deferring the check of {len(services)} services using {image}. {throttled}')
+            for service in services:
+                self.deferred[service.id] = throttled.until
+        return None
+
+    def __check_services(self, swarm, services):
+        """
+        checks all the services for updates and returns the image to update to for every service, in the same order.
+        The services are grouped by image, so every image is resolved once, using up to `check_workers` threads.
+        """
+        groups = {}
+        for service in services:
+            groups.setdefault(swarm.inventory.details(service).normalized_image, []).append(service)
+
+        workers = self.settings['check_workers']
+        if not workers or workers < 2 or len(groups) < 2:
+            digests = [self.__check_image(swarm, group) for group in groups.values()]
+        else:
+            log.debug('Checking %s images of %s services with %s workers', len(groups), len(services), workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cioban-check') as executor:
+                digests = list(executor.map(partial(self.__check_image, swarm), groups.values()))
+        digests = dict(zip(groups, digests))
+
+        checks = []
+        for service in services:
+            details = swarm.inventory.details(service)
+            checks.append(self.__get_updated_image(details.image, details.digest, digests[details.normalized_image]))
+        return checks
+
+    def __update_image(self, swarm, service, update_image):
+        """ fetches the full service and updates it. Returns the service model or `None` if the update failed """
         service_name = service.name
         log.info(f'Updating service {service_name} with image {update_image}')
-        service_updated = False
         try:
-            service.update(image=update_image, force_update=True)
-            service_updated = True
-        except docker.errors.APIError as error:
+            with prometheus.PROM_PHASE_SECONDS.labels('update').time(), \
+                    self.tracer.span('update', service=service_name, image=update_image) as span:
+                model = swarm.client.services.get(service.id)
+                model.update(image=update_image, force_update=True)
+                span.set(outcome='updated')
+        except docker.errors.NotFound:
+            log.warning(f'Service {service_name} disappeared. Removing it from the service list.')
+            self.__remove_service(swarm, service.id)
+            return None
+        except (docker.errors.DockerException, requests.exceptions.RequestException) as error:
             log.error(f'Failed to update {service_name}. The error: {error}')
-        else:
-            log.warning(f'Service {service_name} has been updated')
-        return service_updated
+            self.failures.append(service.id)
+            self.status.failed(swarm.name, service.id, 'update_failed')
+            return None
+        log.warning(f'Service {service_name} has been updated')
+        return model
+
+    def update_images(self, images):
+        """ runs the update for the services using any of the pushed (normalized) images """
+        for image in images:
+            self.digest_cache.invalidate(image)
+        service_ids = set().union(*(swarm.inventory.find_by_image(images) for swarm in self.swarms))
+        if not service_ids:
+            log.debug("No services are using %s", ', '.join(sorted(images)))
+            return
+        log.info(f'Starting update run for {len(service_ids)} services')
+        self.scheduler.defer(self._run(service_ids=service_ids))
+        self.save_state()
 
     @prometheus.PROM_UPDATE_SUMMARY.time()
-    def _run(self):
-        """ the actual run """
+    def _run(self, service_ids=None) -> dict:
+        """
+        the actual run. If `service_ids` is set, only those services are checked
+        :return: The services whose check was deferred by a registry rate limit, with the time to check them again
+        """
+        with self.run_lock:
+            self.deferred = {}
+            self.failures = []
+            self.status.run_started()
+            self.tracer.start_run()
+            self.digest_cache.start_run()
+            with self.tracer.span('run', services=len(service_ids) if service_ids is not None else 'all') as span:
+                if len(self.swarms) == 1:
+                    self.__run(self.swarms[0], service_ids)
+                else:
+                    workers = len(self.swarms)
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cioban-swarm') as executor:
+                        list(executor.map(partial(self.__run, service_ids=service_ids), self.swarms))
+                if self.__notifiers and not self.settings['notify_window']:
+                    self.__notifiers.flush()
+                span.set(outcome='failed' if self.failures else 'ok', deferred=len(self.deferred))
+            if self.deferred:
+                log.warning(f'{len(self.deferred)} services have been deferred because of registry rate limits')
+            self.status.run_finished()
+            self.tracer.finish_run()
+            return self.deferred
+
+    def __run(self, swarm, service_ids):
+        """ checks the services of an endpoint and rolls out the updates """
         services = []
         try:
-            services = self.get_services()
-        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError):
-            log.error('Cannot connect to docker')
-
-        for service in services:
-            webhook = Webhooks(service)
-            try:
-                service_name = service.name
-                image_with_digest = service.attrs['Spec']['TaskTemplate']['ContainerSpec']['Image']
-                image, image_sha = self.__get_image_parts(image_with_digest)
-                prometheus.PROM_SVC_UPDATE_COUNTER.labels(service_name, service.id).inc(0)
-                update_image = self.__get_updated_image(image_sha=image_sha, image=image)
-                service_updated = False
-                if update_image:
-                    service_updated = self.__update_image(service, update_image)
-
-                if service_updated:
-                    webhook.trigger()
-                    updating = True
-                    while updating:
-                        service.reload()
-                        service_updated = True
-
-                        if (
-                                service.attrs.get('UpdateStatus')
-                                and service.attrs['UpdateStatus'].get('State') == 'updating'
-                        ):
-                            log.debug(f'Service {service_name} is in status `updating`. Waiting 1s...')
-                            pause.seconds(1)
-                        else:
-                            log.debug(f'Service {service_name} has converged.')
-                            updating = False
-
-                if service_updated:
-                    prometheus.PROM_SVC_UPDATE_COUNTER.labels(service_name, service.id).inc(1)
-                    notify = {
-                        'service_name': service_name,
-                        'service_short_id': service.short_id,
-                    }
-                    if self.settings['notify_include_image']:
-                        notify['image'] = image
-                    if self.settings['notify_include_old_image']:
-                        notify['old_image'] = image_with_digest
-                    if self.settings['notify_include_new_image']:
-                        notify['new_image'] = service.attrs['Spec']['TaskTemplate']['ContainerSpec']['Image']
-                    self.notify(**notify)
-            except docker.errors.NotFound as error:
-                log.debug(f'Exception caught: {error}')
-                log.warning(f'Service {service_name} disappeared. Reloading the service list.')
-                services = self.get_services()
-
-    def get_services(self):
-        """ gets the list of services and filters out the black listed """
-
-        # first call to get the full list
-        # this will allow us to set a metric `service_info`
-        for service in self.docker.services.list():
-            image = service.attrs['Spec']['TaskTemplate']['ContainerSpec']['Image'].split('@sha256:')
-            try:
-                prometheus.PROM_SVC_INFO.labels(
-                    name=service.name,
-                    id=service.id,
-                    short_id=service.short_id,
-                    image_name=image[0],
-                    image_sha256=image[1]
-                ).set(1)
-            except IndexError:
-                prometheus.PROM_SVC_INFO.labels(
-                    name=service.name,
-                    id=service.id,
-                    short_id=service.short_id,
-                    image_name=image[0],
-                    image_sha256='N/A'
-                ).set(1)
-
-        services = self.docker.services.list(filters=self.settings['filter_services'])
-        for blacklist_service in self.settings['blacklist_services']:
-            for service in services:
-                if service.name == blacklist_service:
-                    log.debug(f'Blacklisted {blacklist_service}')
-                    services.remove(service)
-        return services
+            with prometheus.PROM_PHASE_SECONDS.labels('inventory').time(), \
+                    self.tracer.span('inventory', endpoint=swarm.name) as span:
+                services = self.get_services(service_ids, swarm=swarm)
+                span.set(outcome='listed', services=len(services))
+        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError, docker.errors.DockerException):
+            log.error(f'Cannot connect to docker on {swarm.name}')
+            self.failures.append(swarm.name)
+
+        if self.first_check is None:
+            self.first_check = time.monotonic() - STARTED
+            prometheus.PROM_STARTUP_SECONDS.set(self.first_check)
+            log.debug('First check %.3fs after startup', self.first_check)
+
+        with prometheus.PROM_PHASE_SECONDS.labels('check').time():
+            checks = self.__check_services(swarm, services)
+
+        if self.state:
+            self.state.checked(service.id for service in services if service.id not in self.deferred)
+
+        updates = []
+        for service, update_image in zip(services, checks):
+            details = swarm.inventory.details(service)
+            prometheus.SERVICE_SERIES.updated(swarm.name, service.id, 0)
+            self.__set_status(swarm, service, details, update_image)
+            if update_image:
+                updates.append(Update(service, details.image_with_digest, update_image, group=details.normalized_image))
+
+        self.rollout.run(
+            plan(updates),
+            start=partial(self.__update_image, swarm),
+            converged=partial(self.__service_converged, swarm),
+            failed=partial(self.__service_failed, swarm),
+        )
+
+    def __set_status(self, swarm, service, details, update_image):
+        """ records the result of the check of the service for `/status` """
+        if service.id in self.deferred:
+            self.status.deferred(swarm.name, service, self.deferred[service.id])
+            return
+        registry_digest = None
+        if update_image:
+            registry_digest = self.__get_image_parts(update_image)[1]
+        elif update_image is False:
+            registry_digest = details.digest
+        self.status.checked(swarm.name, service, details, registry_digest)
+
+    def __service_converged(self, swarm, update, model):
+        """ triggers the webhook and the notifications for an updated service """
+        service = swarm.inventory.record(model.attrs)
+        prometheus.PROM_PHASE_SECONDS.labels('convergence').observe(update.duration)
+        swarm.inventory.replace(service)
+        prometheus.SERVICE_SERIES.converged(swarm.name, service.id, update.duration)
+        self.status.updated(swarm.name, service.id, self.__get_image_parts(update.new_image)[1])
+        if self.state:
+            self.state.updated(service.id)
+        with prometheus.PROM_PHASE_SECONDS.labels('webhook').time(), \
+                self.tracer.span('webhook', service=service.name, image=service.image):
+            swarm.inventory.details(service).webhooks.trigger(self.webhooks)
+        prometheus.SERVICE_SERIES.updated(swarm.name, service.id)
+        notify = {
+            'service_name': service.name,
+            'service_short_id': service.short_id,
+        }
+        if len(self.swarms) > 1:
+            notify['endpoint'] = swarm.name
+        if self.settings['notify_include_image']:
+            notify['image'] = update.image
+        if self.settings['notify_include_old_image']:
+            notify['old_image'] = update.old_image
+        if self.settings['notify_include_new_image']:
+            notify['new_image'] = service.image
+        with prometheus.PROM_PHASE_SECONDS.labels('notify').time(), \
+                self.tracer.span('notify', service=service.name, image=service.image):
+            self.notify(**notify)
+
+    def __service_failed(self, swarm, update):
+        """ logs the reason why the service didn't converge """
+        if update.state == 'disappeared':
+            log.warning(f'Service {update.service.name} disappeared. Removing it from the service list.')
+            # also drops it from `/status`, so no failed entry is recorded for it
+            self.__remove_service(swarm, update.service.id)
+            return
+        log.error(f'Service {update.service.name} did not converge. The state: {update.state}')
+        self.failures.append(update.service.id)
+        self.status.failed(swarm.name, update.service.id, update.state)
+
+    def get_services(self, service_ids=None, swarm=None):
+        """
+        refreshes the inventory with a single call and returns the filtered, not black listed, services
+        :param service_ids: If set, only these services are reloaded and returned
+        :param swarm: If set, only the services of this endpoint are returned. Otherwise the services of all endpoints
+        """
+        if not swarm:
+            return [service for each in self.swarms for service in self.get_services(service_ids, each)]
+
+        if service_ids is not None:
+            service_ids = {service_id for service_id in service_ids if service_id in swarm.inventory.services}
+            # a few services are cheaper to reload one by one than listing all the services
+            if len(service_ids) <= self.reload_limit and not swarm.inventory.watching:
+                for service_id in service_ids:
+                    try:
+                        swarm.inventory.replace(swarm.inventory.fetch(swarm.client, service_id))
+                    except docker.errors.NotFound:
+                        self.__remove_service(swarm, service_id)
+                return [service for service in swarm.inventory.selected() if service.id in service_ids]
+
+        if swarm.inventory.watching:
+            log.debug('%s: Using the service list from the events stream', swarm.name)
+        else:
+            swarm.inventory.refresh(swarm.client)
+            swarm.listed = time.time()
+        # the services removed since, also the ones removed by the events stream, are dropped from `/status`
+        self.status.retain(swarm.name, swarm.inventory.services)
+        if service_ids is not None:
+            return [service for service in swarm.inventory.selected() if service.id in service_ids]
+        return swarm.inventory.selected()
+
+    def __remove_service(self, swarm, service_id: str):
+        """ drops a service that doesn't exist anymore from the inventory and from `/status` """
+        swarm.inventory.remove(service_id)
+        self.status.remove(swarm.name, service_id)
 
     def notify(self, **kwargs):
         """ Sends a notification through the registered notifiers """
-        self.notifiers.notify(**kwargs)
+        if self.settings['notifiers']:
+            self.notifiers.notify(**kwargs)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Caches the registry digests of images """
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from . import prometheus
+from .helpers import normalize_image, parse_image
+
+log = logging.getLogger('cioban')
+
+
+class DigestCache():
+    """
+    Resolves every image reference only once per run. If `ttl` is set, the resolved digests are also kept across runs
+    in a LRU cache of at most `size` entries.
+
+    The cache is thread safe. Concurrent lookups of the same image wait for the first one to finish. If the resolver
+    raises, nothing is remembered and the waiting lookups try again.
+    """
+
+    def __init__(self, ttl: int = 0, size: int = 1000):
+        self.ttl = ttl
+        self.size = size
+        self.run_cache = {}
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def start_run(self):
+        """ forgets the digests resolved during the previous run """
+        with self.lock:
+            self.run_cache = {}
+
+    def invalidate(self, image: str):
+        """ forgets the cached digest of an image, for example after a new push """
+        with self.lock:
+            self.cache.pop(normalize_image(image), None)
+
+    def resolve(self, image: str, resolver):
+        """
+        Returns the digest for the image, calling `resolver(image)` only if the digest is not cached
+        :param image: The image reference, without digest
+        :param resolver: A callable returning the registry digest of the image or `None` if it can't be resolved
+        :return: The digest or `None`
+        """
+        key = normalize_image(image)
+        while True:
+            with self.lock:
+                if key in self.run_cache:
+                    prometheus.PROM_DIGEST_CACHE_HITS.inc()
+                    log.debug('%s: Digest already resolved in this run', image)
+                    return self.run_cache[key]
+
+                pending = self.pending.get(key)
+                if not pending:
+                    digest = self._get(key)
+                    if digest:
+                        prometheus.PROM_DIGEST_CACHE_HITS.inc()
+                        log.debug('%s: Using the cached digest %s', image, digest)
+                        self.run_cache[key] = digest
+                        return digest
+                    self.pending[key] = threading.Event()
+                    break
+
+            # another thread is already resolving this image. If it raised, the lookup is tried again.
+            pending.wait()
+
+        prometheus.PROM_DIGEST_CACHE_MISSES.inc()
+        try:
+            digest = resolver(image)
+        except Exception:
+            with self.lock:
+                self.pending.pop(key).set()
+            raise
+        with self.lock:
+            if digest:
+                self._set(key, digest)
+            # failures are remembered too, so the other services using the same image don't retry during this run
+            self.run_cache[key] = digest
+            self.pending.pop(key).set()
+        return digest
+
+    def dump(self) -> dict:
+        """ returns the cached digests with their expiry as timestamp, to be restored with `restore()` """
+        offset = time.time() - time.monotonic()
+        with self.lock:
+            return {key: [digest, expires + offset] for key, (digest, expires) in self.cache.items()}
+
+    def restore(self, entries: dict):
+        """ fills the cache with the digests from `dump()`, skipping the expired ones """
+        if not self.ttl:
+            return
+        offset = time.time() - time.monotonic()
+        with self.lock:
+            for key, (digest, expires) in entries.items():
+                # the TTL might have been lowered since the entries were saved
+                expires = min(expires - offset, time.monotonic() + self.ttl)
+                if expires > time.monotonic():
+                    self.cache[key] = (digest, expires)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def _get(self, key: str):
+        """ returns the digest from the LRU cache, if it's still valid """
+        if not self.ttl or key not in self.cache:
+            return None
+        digest, expires = self.cache[key]
+        if expires < time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return digest
+
+    def _set(self, key: str, digest: str):
+        """ stores the digest in the LRU cache and evicts the least recently used entries """
+        if not self.ttl:
+            return
+        self.cache[key] = (digest, time.monotonic() + self.ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+
+def registry_limiter(concurrency: int = 0):
+    """
+    returns a function limiting the number of concurrent lookups against the same registry, with a semaphore per
+    registry
+    """
+    semaphores = {}
+    lock = threading.Lock()
+
+    def limit(image: str):
+        """ returns a context manager that holds a slot of the registry of the image """
+        if not concurrency or concurrency < 1:
+            return nullcontext()
+        registry = parse_image(image)[0]
+        with lock:
+            if registry not in semaphores:
+                semaphores[registry] = threading.BoundedSemaphore(concurrency)
+            return semaphores[registry]
+
+    return limit
@@ -27,6 +27,37 @@ def gather_environ(keys=None) -> dict:
             'schedule_time': 'string',
             'sleep_time': 'string',
             'prometheus_port': 'int',
+            'digest_cache_ttl': 'int',
+            'digest_cache_size': 'int',
+            'check_workers': 'int',
+            'registry_concurrency': 'int',
+            'max_concurrent_updates': 'int',
+            'update_group_concurrency': 'int',
+            'update_timeout': 'int',
+            'registry_client': 'string',
+            'registry_auth_file': 'string',
+            'insecure_registries': 'list',
+            'inventory_events': 'boolean',
+            'inventory_resync_time': 'int',
+            'push_port': 'int',
+            'push_token': 'string',
+            'webhook_workers': 'int',
+            'webhook_queue_size': 'int',
+            'notify_mode': 'string',
+            'notify_window': 'int',
+            'notify_rate_limit': 'int',
+            'notify_max_pending': 'int',
+            'metrics_max_series': 'int',
+            'docker_endpoints': 'list',
+            'schedule_jitter': 'int',
+            'registry_rate_limits': 'list',
+            'registry_retry_after': 'int',
+            'state_file': 'string',
+            'run_once': 'boolean',
+            'pushgateway_url': 'string',
+            'trace_dir': 'string',
+            'trace_format': 'string',
+            'trace_keep': 'int',
         }
     environs = {}
     for key, key_type in keys.items():
@@ -49,8 +80,14 @@ def gather_environ(keys=None) -> dict:
                     environs[key] = False
                     continue
             if key_type == 'filter':
-                filters = environs[key].split('=', 1)
-                environs[key] = {filters[0]: filters[1]}
+                filters = []
+                for item in environs[key].split():
+                    name, has_value, value = item.partition('=')
+                    if not has_value or not value:
+                        log.warning(f"`{item}` not understood for {key.upper()}. Ignoring.")
+                        continue
+                    filters.append((name, value))
+                environs[key] = filters
             log.info(f'{key.upper()} is set')
     return environs
 
@@ -59,6 +96,55 @@ def short_msg(msg: str, chars=150) -> str:
     """ Truncates the message to {chars} characters and adds three dots at the end """
     return (str(msg)[:chars] + '..') if len(str(msg)) > chars else str(msg)
 
+
+def parse_duration(value: str) -> int:
+    """
+    Converts a duration like `SLEEP_TIME` to seconds. Accepted are numbers ending in one of `s`, `m`, `h`, `d`, `w`.
+    Numbers without unit are minutes.
+    """
+    relation = {
+        's': 1,
+        'm': 60,
+        'h': 3600,
+        'd': 86400,
+        'w': 604800,
+    }
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value) * relation['m']
+    if value[-1:] in relation and value[:-1].isdigit():
+        return int(value[:-1]) * relation[value[-1]]
+    raise ValueError(f"{value} not understood")
+
+
+def parse_image(image: str) -> tuple:
+    """
+    Splits an image reference into its registry, repository and tag, the way docker resolves them
+    :param image: The image reference, with or without tag or digest (for example `nginx` or `ghcr.io/ix-ai/smtp`)
+    :return: A tuple of (registry, repository, tag)
+    """
+    image = image.split('@', 1)[0]
+    registry = 'docker.io'
+    parts = image.split('/', 1)
+    if len(parts) > 1 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry = parts[0]
+        image = parts[1]
+    tag = 'latest'
+    name, _, maybe_tag = image.rpartition(':')
+    if name and '/' not in maybe_tag:
+        image = name
+        tag = maybe_tag
+    if registry == 'docker.io' and '/' not in image:
+        image = f'library/{image}'
+    return registry, image, tag
+
+
+def normalize_image(image: str) -> str:
+    """ Returns the fully qualified `registry/repository:tag` reference for an image """
+    registry, repository, tag = parse_image(image)
+    return f'{registry}/{repository}:{tag}'
+
+
 def strtobool(val):
     """Convert a string representation of truth to true (1) or false (0).
     True values are 'y', 'yes', 't', 'true', 'on', and '1'; false values
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Keeps a snapshot of the swarm services """
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+import requests
+import docker
+from . import prometheus
+from .helpers import normalize_image
+from .selector import Selector
+from .service import ServiceRecord
+from .webhooks import Webhooks
+
+log = logging.getLogger('cioban')
+
+
+@dataclass
+class ServiceDetails():
+    """ What cioban derives from the spec of a service. Only computed again when the `Version.Index` changes """
+    image_with_digest: str
+    image: str
+    digest: str
+    normalized_image: str
+    webhooks: Webhooks
+    webhook: dict
+    selected: bool
+
+    @classmethod
+    def from_service(cls, service, selected: bool):
+        """ derives the details from the spec of the service """
+        image, _, digest = service.image.partition('@')
+        webhooks = Webhooks(service)
+        return cls(
+            image_with_digest=service.image,
+            image=image,
+            digest=digest or None,
+            normalized_image=normalize_image(image),
+            webhooks=webhooks,
+            webhook=webhooks.summary(),
+            selected=selected,
+        )
+
+
+class Inventory():
+    """
+    Holds the services from a single `GET /services` call, as `ServiceRecord`. The `Selector`, compiled from the
+    `FILTER_SERVICES` filters and the blacklist, is applied on the snapshot.
+
+    If `watch()` is called, the snapshot is kept up to date from the docker service events, with a full resync every
+    `resync` seconds.
+
+    The `ServiceDetails` of every service are kept by service ID and only derived again when the spec version changes.
+    """
+    reconnect_max = 60
+
+    def __init__(self, endpoint: str = 'default', selector: Selector = None):
+        self.endpoint = endpoint
+        self.selector = selector or Selector()
+        self.services = {}
+        self.images = {}
+        self.cache = {}
+        self.state = None
+        self.lock = threading.Lock()
+
+    @property
+    def refreshed(self) -> bool:
+        """ `True` once the services have been listed """
+        return self.state is not None
+
+    @property
+    def watching(self) -> bool:
+        """ `True` while the snapshot is kept up to date from the service events """
+        return self.state == 'watching'
+
+    def refresh(self, client):
+        """ replaces the snapshot with the current list of services """
+        # the records are built from the raw list, without creating a `Service` model for every service
+        services = [self.record(attrs) for attrs in client.api.services()]
+        with self.lock:
+            self.services = {service.id: service for service in services}
+            self.cache = {
+                service_id: cached for service_id, cached in self.cache.items() if service_id in self.services
+            }
+            self.images = {}
+            for service in services:
+                self.images.setdefault(self.details(service).normalized_image, set()).add(service.id)
+            self.state = self.state or 'listed'
+        prometheus.SERVICE_SERIES.retain(self.endpoint, self.services)
+        for service in services:
+            self.set_service_info(service)
+        log.debug('%s: Found %s services', self.endpoint, len(services))
+
+    def replace(self, service):
+        """ updates a single service in the snapshot, unless the snapshot already holds a newer version of it """
+        with self.lock:
+            current = self.services.get(service.id)
+            if current and current.version > service.version:
+                return
+            if current:
+                self.images.get(self.details(current).normalized_image, set()).discard(service.id)
+            self.services[service.id] = service
+            self.images.setdefault(self.details(service).normalized_image, set()).add(service.id)
+        self.set_service_info(service)
+
+    def remove(self, service_id: str):
+        """ drops a service that doesn't exist anymore from the snapshot """
+        with self.lock:
+            service = self.services.pop(service_id, None)
+            cached = self.cache.pop(service_id, None)
+            if cached:
+                self.images.get(cached[1].normalized_image, set()).discard(service_id)
+        if service:
+            prometheus.SERVICE_SERIES.remove(self.endpoint, service_id)
+            log.debug('Removed %s from the inventory', service.name)
+
+    def fetch(self, client, service_id: str) -> ServiceRecord:
+        """ returns the current record of a single service. Raises `docker.errors.NotFound` if it doesn't exist """
+        return self.record(client.api.inspect_service(service_id))
+
+    def record(self, attrs: dict) -> ServiceRecord:
+        """ builds the record of a service from its JSON, keeping the labels needed by the filters """
+        return ServiceRecord(attrs, self.selector.label_keys)
+
+    def find_by_image(self, images) -> set:
+        """ returns the IDs of the services running any of the normalized image references """
+        with self.lock:
+            return set().union(*(self.images.get(image, set()) for image in images))
+
+    def watch(self, client, resync: int = 3600):
+        """ starts following the service events in the background """
+        thread = threading.Thread(
+            target=self.__watch, args=(client, resync), name=f'cioban-inventory-{self.endpoint}', daemon=True
+        )
+        thread.start()
+
+    def __watch(self, client, resync: int):
+        """ follows the service events. Every `resync` seconds and after every error the snapshot is listed again """
+        failures = 0
+        while True:
+            try:
+                since = int(time.time())
+                self.refresh(client)
+                self.state = 'watching'
+                failures = 0
+                log.debug('%s: Following the service events for %ss', self.endpoint, resync)
+                # the stream ends at `until`, which triggers the next full resync
+                for event in client.events(since=since, until=since + resync, filters={'type': 'service'}, decode=True):
+                    self.__handle_event(client, event)
+            except (docker.errors.APIError, requests.exceptions.RequestException) as error:
+                if self.watching:
+                    self.state = 'listed'
+                failures += 1
+                wait = min(2 ** failures, self.reconnect_max)
+                log.error(f'{self.endpoint}: Lost the service events stream. Reconnecting in {wait}s. Error: {error}')
+                time.sleep(wait)
+
+    def __handle_event(self, client, event: dict):
+        """ applies a single service event to the snapshot """
+        action = event.get('Action')
+        service_id = event.get('Actor', {}).get('ID')
+        log.debug('Service event `%s` for %s', action, service_id)
+        if action == 'remove':
+            self.remove(service_id)
+        elif action in ('create', 'update'):
+            try:
+                self.replace(self.fetch(client, service_id))
+            except docker.errors.NotFound:
+                self.remove(service_id)
+
+    def selected(self) -> list:
+        """ returns the services that match the filters and are not blacklisted """
+        with self.lock:
+            snapshot = list(self.services.values())
+        return [service for service in snapshot if self.details(service).selected]
+
+    def details(self, service) -> ServiceDetails:
+        """ returns the `ServiceDetails` of the service, deriving them again only if the spec changed """
+        cached = self.cache.get(service.id)
+        if cached and cached[0] == service.version:
+            return cached[1]
+        details = ServiceDetails.from_service(service, self.selector.select(service))
+        self.cache[service.id] = (service.version, details)
+        return details
+
+    def set_service_info(self, service):
+        """ sets the `service_info` metric for the service """
+        details = self.details(service)
+        prometheus.SERVICE_SERIES.set_info(
+            endpoint=self.endpoint,
+            service=service,
+            image_name=details.image,
+            image_sha256=details.digest[len('sha256:'):] if details.digest else 'N/A',
+        )
@@ -2,12 +2,54 @@
 # -*- coding: utf-8 -*-
 """ Global logging configuration """
 
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import time
 import pygelf
 
 
-def setup_logger(name, level='INFO', gelf_host=None, gelf_port=None, **kwargs):
-    """ sets up the logger """
+def repeat_filter(window: int):
+    """
+    returns a filter letting an identical message below `WARNING` through only once every `window` seconds. The next one
+    after the window tells how many have been suppressed in the meantime.
+    """
+    seen = {}
+    lock = threading.Lock()
+
+    def filter_record(record):
+        nonlocal seen
+        if record.levelno >= logging.WARNING:
+            return True
+        try:
+            key = (record.msg, record.args)
+            hash(key)
+        except TypeError:
+            key = record.getMessage()
+        now = time.monotonic()
+        with lock:
+            last, suppressed = seen.get(key, (0, 0))
+            if now - last < window:
+                seen[key] = (last, suppressed + 1)
+                return False
+            seen[key] = (now, 0)
+            if len(seen) > 10000:
+                # forget the messages that are out of the window anyway
+                seen = {key: value for key, value in seen.items() if now - value[0] < window}
+        if suppressed:
+            record.msg = f'{record.msg} ({suppressed} repetitions suppressed)'
+        return True
+
+    return filter_record
+
+
+def setup_logger(name, level='INFO', gelf_host=None, gelf_port=None, dedup_window=0, **kwargs):
+    """
+    sets up the logger. The records are passed through a queue to a background thread, so writing them to the console
+    and to GELF doesn't block the caller
+    """
     logging.basicConfig(handlers=[logging.NullHandler()])
     formatter = logging.Formatter(
         fmt='%(asctime)s.%(msecs)03d %(levelname)s [%(module)s.%(funcName)s] %(message)s',
@@ -18,20 +60,29 @@ def setup_logger(name, level='INFO', gelf_host=None, gelf_port=None, **kwargs):
 
     handler = logging.StreamHandler()
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    handlers = [handler]
 
     if gelf_host and gelf_port:
-        handler = pygelf.GelfUdpHandler(
+        handlers.append(pygelf.GelfUdpHandler(
             host=gelf_host,
             port=gelf_port,
             debug=True,
             include_extra_fields=True,
             **kwargs
-        )
-        logger.addHandler(handler)
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    if dedup_window:
+        queue_handler.addFilter(repeat_filter(dedup_window))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # writes out the queued records before exiting
+    atexit.register(listener.stop)
+    logger.addHandler(queue_handler)
 
     ix_logger = logging.getLogger('ix_notifiers')
     ix_logger.setLevel(level)
-    ix_logger.addHandler(handler)
+    ix_logger.addHandler(queue_handler)
 
     return logger
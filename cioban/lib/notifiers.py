@@ -3,6 +3,9 @@
 """ notification core """
 
 import logging
+import queue
+import threading
+import time
 from ix_notifiers.core import IxNotifiers
 
 log = logging.getLogger('cioban')
@@ -14,17 +17,124 @@ def start():
 
 
 class Notify(IxNotifiers):
-    """ the notification core class """
+    """
+    the notification core class
+
+    Once `configure()` is called, the notifications are sent by a background thread. In `digest` mode, the service
+    update notifications are collected and sent as a single message on `flush()` or, if `window` is set, `window`
+    seconds after the first one.
+    """
+    settings = {
+        'mode': 'immediate',
+        'window': 0,
+        'rate_limit': 0,
+        'max_pending': 100,
+    }
+    modes = ['immediate', 'digest']
+
+    def __init__(self):
+        super().__init__()
+        self.queue = None
+        self.pending = []
+        self.dropped = 0
+        self.timer = None
+        self.last_sent = {}
+        self.lock = threading.Lock()
+
+    def configure(self, **kwargs):
+        """ sets the delivery settings and starts the background sender """
+        for k, v in kwargs.items():
+            if k in self.settings:
+                self.settings[k] = v
+        if self.settings['mode'] not in self.modes:
+            raise ValueError(f"{self.settings['mode']} not understood for the notification mode")
+        if not self.queue:
+            self.queue = queue.Queue(maxsize=self.settings['max_pending'])
+            threading.Thread(target=self.__work, name='cioban-notify', daemon=True).start()
 
     def notify(self, **kwargs):
-        """ dispatches a notification to the registered notifiers """
+        """ queues a notification for the registered notifiers """
+        if not self.registered:
+            return
+        if self.settings['mode'] == 'digest' and 'message' not in kwargs and self.queue:
+            self.__collect(kwargs)
+            return
         title = kwargs.get('title', 'Service Updated')
         kwargs['title'] = f'CIOBAN: {title}'
+        self.__submit(kwargs)
+
+    def flush(self):
+        """ sends the collected service update notifications as a single message """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            dropped, self.dropped = self.dropped, 0
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return
+
+        message = ''
+        for notification in pending:
+            message += '- ' + ', '.join(f"{k.replace('_', ' ')}: `{v}`" for k, v in notification.items()) + '  \n'
+        if dropped:
+            message += f'- ... and {dropped} more  \n'
+        count = len(pending) + dropped
+        self.__submit({
+            'title': f"CIOBAN: {count} Service{'s' if count > 1 else ''} Updated",
+            'message': message,
+        })
+
+    def join(self):
+        """ sends the collected notifications and waits until all the queued notifications have been sent """
+        self.flush()
+        if self.queue:
+            self.queue.join()
+
+    def __collect(self, notification: dict):
+        """ keeps a service update notification for the next digest """
+        with self.lock:
+            if len(self.pending) < self.settings['max_pending']:
+                self.pending.append(notification)
+            else:
+                self.dropped += 1
+            if self.settings['window'] and not self.timer:
+                self.timer = threading.Timer(self.settings['window'], self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def __submit(self, notification: dict):
+        """ hands the notification to the background sender or, if not configured, sends it right away """
+        if not self.queue:
+            self.dispatch(**notification)
+            return
+        try:
+            self.queue.put_nowait(notification)
+        except queue.Full:
+            log.error(f"Too many pending notifications. Dropping '{notification['title']}'.")
+
+    def __work(self):
+        """ sends the queued notifications """
+        while True:
+            notification = self.queue.get()
+            try:
+                self.dispatch(**notification)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f'Failed to send the notification. The error: {e}')
+            self.queue.task_done()
+
+    def dispatch(self, **kwargs):
+        """ dispatches a notification to the registered notifiers """
         for notifier_name, notifier in self.registered.items():
-            log.debug(f'Sending notification to {notifier_name}')
+            wait = self.last_sent.get(notifier_name, 0) + self.settings['rate_limit'] - time.monotonic()
+            if wait > 0:
+                log.debug('Rate limiting %s. Waiting %.1fs...', notifier_name, wait)
+                time.sleep(wait)
+            log.debug('Sending notification to %s', notifier_name)
             # pylint: disable=unnecessary-dunder-call
             notification_method = self.__getattribute__(f'{notifier_name}_notify')
             notification_method(notifier=notifier, **kwargs)
+            self.last_sent[notifier_name] = time.monotonic()
 
     def gotify_notify(self, notifier, **kwargs):
         """ parses the arguments, formats the message and dispatches it """
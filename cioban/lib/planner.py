@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Groups the service updates by image and orders them for the rollout """
+
+import logging
+
+log = logging.getLogger('cioban')
+
+ORDER_LABEL = 'cioban.update.order'
+
+
+def update_order(service) -> int:
+    """ returns the `cioban.update.order` of the service. Services without the label have the order `0` """
+    value = service.labels.get(ORDER_LABEL)
+    if value is None:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        log.warning(f'{service.name}: `{value}` not understood for {ORDER_LABEL}. Using 0.')
+        return 0
+
+
+def plan(updates: list) -> list:
+    """
+    Orders the updates so the services of the same image are rolled out together, as one group. The groups with the
+    lowest `cioban.update.order` come first, the others keep the order in which their image has been found. Inside a
+    group, the services are ordered by their `cioban.update.order`.
+    :param updates: A list of `Update`, with `group` set to the image the services are updated to
+    :return: The ordered list of `Update`, with `order` set from the labels
+    """
+    groups = {}
+    for update in updates:
+        update.order = update_order(update.service)
+        groups.setdefault(update.group, []).append(update)
+
+    planned = []
+    for group in sorted(groups.values(), key=lambda group: min(update.order for update in group)):
+        planned.extend(sorted(group, key=lambda update: update.order))
+    if planned:
+        log.info(f'Rolling out {len(planned)} updates in {len(groups)} image groups')
+    return planned
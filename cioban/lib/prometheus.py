@@ -2,14 +2,17 @@
 # -*- coding: utf-8 -*-
 """ Initializes the prometheus metrics """
 
-from prometheus_client import Summary, Counter, Info, Enum, Gauge
+import threading
+from collections import OrderedDict
+from prometheus_client import Summary, Counter, Info, Enum, Gauge, Histogram
 
 # Prometheus metrics
 PROM_UPDATE_SUMMARY = Summary('update_run_seconds', 'Time spent processing updates')
 PROM_SVC_UPDATE_COUNTER = Counter(
     'service_updated', 'Shows if a service has been updated', [
         'name',
-        'id'
+        'id',
+        'endpoint'
     ]
 )
 PROM_SVC_INFO = Gauge(
@@ -18,8 +21,137 @@ PROM_SVC_INFO = Gauge(
         'id',
         'short_id',
         'image_name',
-        'image_sha256'
+        'image_sha256',
+        'endpoint'
     ]
 )
 PROM_INFO = Info('cioban', 'Information about cioban')
 PROM_STATE_ENUM = Enum('cioban_state', 'The current state of cioban', states=['running', 'sleeping'])
+PROM_DIGEST_CACHE_HITS = Counter('digest_cache_hits', 'Registry digest lookups answered from the cache')
+PROM_DIGEST_CACHE_MISSES = Counter('digest_cache_misses', 'Registry digest lookups sent to the registry')
+PROM_WEBHOOK_SECONDS = Histogram('webhook_seconds', 'Time spent sending a webhook')
+PROM_WEBHOOK_QUEUE = Gauge('webhook_queue', 'Webhooks waiting to be sent')
+PROM_WEBHOOK_FAILURES = Counter('webhook_failures', 'Webhooks that could not be delivered')
+PROM_PHASE_SECONDS = Histogram(
+    'update_phase_seconds', 'Time spent in each phase of the update run', [
+        'phase'
+    ],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf'))
+)
+PROM_REGISTRY_LOOKUP_SECONDS = Histogram(
+    'registry_lookup_seconds', 'Time spent resolving a digest from the registry', [
+        'registry'
+    ]
+)
+PROM_REGISTRY_ERRORS = Counter(
+    'registry_lookup_errors', 'Failed digest lookups', [
+        'registry'
+    ]
+)
+PROM_REGISTRY_QUOTA = Gauge(
+    'registry_quota_remaining', 'Lookups left within the rate limit of the registry', [
+        'registry'
+    ]
+)
+PROM_REGISTRY_THROTTLED_SECONDS = Counter(
+    'registry_throttled_seconds', 'Time the lookups against the registry were held back by its rate limit', [
+        'registry'
+    ]
+)
+PROM_REGISTRY_DEFERRED = Counter(
+    'registry_deferred_lookups', 'Lookups deferred to a later run because of the rate limit of the registry', [
+        'registry'
+    ]
+)
+PROM_SVC_CONVERGENCE = Gauge(
+    'service_convergence_seconds', 'How long the last update of the service took to converge', [
+        'name',
+        'id',
+        'endpoint'
+    ]
+)
+PROM_STARTUP_SECONDS = Gauge('cioban_startup_seconds', 'Time from the start of cioban until the first check')
+PROM_PENDING_UPDATES = Gauge('services_pending_update', 'Services with an update that has not converged yet')
+
+
+class ServiceSeries():
+    """
+    Remembers the label sets of the per-service metrics, so the series of services that changed their image or don't
+    exist anymore can be removed. If `max_series` is set, the series of the least recently seen services are removed
+    once more than `max_series` services are tracked.
+
+    The other per-service series are only written through `updated()` and `converged()`, which skip the services that
+    are not tracked, so they stay within the same cap.
+    """
+    service_metrics = [PROM_SVC_UPDATE_COUNTER, PROM_SVC_CONVERGENCE]
+
+    def __init__(self, max_series: int = 0):
+        self.max_series = max_series
+        self.services = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set_info(self, endpoint: str, service, image_name: str, image_sha256: str):
+        """ sets `service_info` for the service (with `name`, `id` and `short_id`) and removes its previous series """
+        labels = (service.name, service.id, service.short_id, image_name, image_sha256, endpoint)
+        key = (endpoint, service.id)
+        with self.lock:
+            previous = self.services.get(key)
+            if previous and previous != labels:
+                self.__remove(PROM_SVC_INFO, previous)
+            self.services[key] = labels
+            self.services.move_to_end(key)
+            PROM_SVC_INFO.labels(*labels).set(1)
+            while self.max_series and len(self.services) > self.max_series:
+                self.__remove_service(self.services.popitem(last=False)[1])
+
+    def updated(self, endpoint: str, service_id: str, count: int = 1):
+        """ counts the updates of the service in `service_updated`. With `count=0`, the series is only created """
+        with self.lock:
+            series = self.__series(PROM_SVC_UPDATE_COUNTER, endpoint, service_id)
+            if series:
+                series.inc(count)
+
+    def converged(self, endpoint: str, service_id: str, seconds: float):
+        """ sets how long the last update of the service took to converge """
+        with self.lock:
+            series = self.__series(PROM_SVC_CONVERGENCE, endpoint, service_id)
+            if series:
+                series.set(seconds)
+
+    def remove(self, endpoint: str, service_id: str):
+        """ removes all the series of a service """
+        with self.lock:
+            labels = self.services.pop((endpoint, service_id), None)
+            if labels:
+                self.__remove_service(labels)
+
+    def retain(self, endpoint: str, service_ids):
+        """ removes the series of all the services of the endpoint not in `service_ids` """
+        with self.lock:
+            for key in [key for key in self.services if key[0] == endpoint and key[1] not in service_ids]:
+                self.__remove_service(self.services.pop(key))
+
+    def __remove_service(self, labels: tuple):
+        """ removes the `service_info` series and the other per-service series """
+        self.__remove(PROM_SVC_INFO, labels)
+        name, service_id, endpoint = labels[0], labels[1], labels[-1]
+        for metric in self.service_metrics:
+            self.__remove(metric, (name, service_id, endpoint))
+
+    def __series(self, metric, endpoint: str, service_id: str):
+        """ returns the series of a per-service metric, or `None` if the service is not tracked. Needs the lock """
+        labels = self.services.get((endpoint, service_id))
+        if not labels:
+            return None
+        return metric.labels(labels[0], labels[1], endpoint)
+
+    @staticmethod
+    def __remove(metric, labels: tuple):
+        """ removes a series, if it exists """
+        try:
+            metric.remove(*labels)
+        except KeyError:
+            pass
+
+
+SERVICE_SERIES = ServiceSeries()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Keeps the digest lookups within the rate limits of the registries """
+
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from . import prometheus
+from .helpers import parse_duration
+
+log = logging.getLogger('cioban')
+
+
+class Throttled(Exception):
+    """ Raised when a registry can't be queried right now. `until` is the timestamp when it can be retried """
+
+    def __init__(self, registry: str, until: float):
+        self.registry = registry
+        self.until = until
+        super().__init__(f'{registry} is rate limited for {max(until - time.time(), 0):.0f}s')
+
+
+def parse_retry_after(value):
+    """ returns the seconds from a `Retry-After` header, in seconds or as HTTP date, or `None` if not understood """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket():
+    """ Allows `rate` lookups every `period` seconds, with bursts of up to `rate` lookups """
+
+    def __init__(self, rate: int, period: int):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.refill = rate / period
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """ returns the seconds until the next token is available """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.refill
+
+    def take(self):
+        """ takes a token. It can be taken before it's available, so the next lookups queue up behind this one """
+        self.tokens -= 1
+
+    def limit(self, remaining: int):
+        """ caps the tokens to the remaining quota reported by the registry """
+        self.wait_time()
+        self.tokens = min(self.tokens, remaining)
+
+
+class RegistryThrottle():
+    """
+    Limits the lookups against the registries with a configured rate (`registry=rate/period`, for example
+    `docker.io=100/6h`) with a token bucket each. All the other registries are not limited.
+
+    A lookup waits up to `max_wait` seconds for a token, otherwise it's deferred by raising `Throttled`. Once a
+    registry answers with HTTP 429, all the lookups against it are deferred until `Retry-After` has passed, or
+    `retry_after` seconds if the registry doesn't say.
+    """
+    max_wait = 5
+
+    def __init__(self, rates: list = None, retry_after: int = 300):
+        self.retry_after = retry_after
+        self.buckets = {}
+        self.paused = {}
+        self.lock = threading.Lock()
+        for rate in rates or []:
+            registry, bucket = self.parse_rate(rate)
+            self.buckets[registry] = bucket
+            prometheus.PROM_REGISTRY_QUOTA.labels(registry).set(bucket.capacity)
+
+    @staticmethod
+    def parse_rate(rate: str) -> tuple:
+        """ parses `registry=rate/period` and returns a tuple of (registry, `TokenBucket`) """
+        registry, _, limit = rate.partition('=')
+        count, _, period = limit.partition('/')
+        try:
+            bucket = TokenBucket(int(count), parse_duration(period or '1h'))
+        except (ValueError, ZeroDivisionError) as e:
+            raise ValueError(f'{rate} not understood for REGISTRY_RATE_LIMITS. The error: {e}') from e
+        if not registry or bucket.capacity < 1:
+            raise ValueError(f'{rate} not understood for REGISTRY_RATE_LIMITS')
+        return registry, bucket
+
+    def acquire(self, registry: str):
+        """ takes a token for a lookup against the registry, waiting for it if needed. Raises `Throttled` """
+        with self.lock:
+            paused = self.paused.get(registry)
+            if paused:
+                if paused > time.time():
+                    prometheus.PROM_REGISTRY_DEFERRED.labels(registry).inc()
+                    raise Throttled(registry, paused)
+                del self.paused[registry]
+
+            bucket = self.buckets.get(registry)
+            if not bucket:
+                return
+            wait = bucket.wait_time()
+            if wait > self.max_wait:
+                prometheus.PROM_REGISTRY_DEFERRED.labels(registry).inc()
+                raise Throttled(registry, time.time() + wait)
+            bucket.take()
+            prometheus.PROM_REGISTRY_QUOTA.labels(registry).set(max(int(bucket.tokens), 0))
+
+        if wait:
+            log.debug('%s: Waiting %.1fs for the rate limit', registry, wait)
+            prometheus.PROM_REGISTRY_THROTTLED_SECONDS.labels(registry).inc(wait)
+            time.sleep(wait)
+
+    def observe(self, registry: str, remaining: int):
+        """ updates the remaining quota with the one reported by the registry """
+        with self.lock:
+            bucket = self.buckets.get(registry)
+            if bucket:
+                bucket.limit(remaining)
+        prometheus.PROM_REGISTRY_QUOTA.labels(registry).set(remaining)
+
+    def pause(self, registry: str, retry_after=None) -> float:
+        """ defers the lookups against the registry, after a HTTP 429. Returns the timestamp when they can resume """
+        seconds = self.retry_after if retry_after is None else retry_after
+        now = time.time()
+        with self.lock:
+            paused = max(self.paused.get(registry, 0), now)
+            until = max(paused, now + seconds)
+            self.paused[registry] = until
+        # only the extension is counted, the concurrent lookups usually get the same answer
+        prometheus.PROM_REGISTRY_THROTTLED_SECONDS.labels(registry).inc(until - paused)
+        prometheus.PROM_REGISTRY_QUOTA.labels(registry).set(0)
+        log.warning(f'{registry} is rate limiting the lookups. Deferring them for {seconds:.0f}s.')
+        return until
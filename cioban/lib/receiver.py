@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Receives the push notifications from the registries """
+
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .helpers import normalize_image
+
+log = logging.getLogger('cioban')
+
+
+def parse_notification(payload: dict) -> set:
+    """
+    Returns the normalized image references pushed according to a registry notification. Supported are the Docker
+    Distribution (also used by GitLab), Harbor and Docker Hub formats.
+    """
+    images = set()
+    # Docker Distribution / GitLab
+    for event in payload.get('events', []):
+        target = event.get('target', {})
+        if event.get('action') == 'push' and target.get('repository') and target.get('tag'):
+            host = event.get('request', {}).get('host')
+            repository = f"{host}/{target['repository']}" if host else target['repository']
+            images.add(normalize_image(f"{repository}:{target['tag']}"))
+
+    # Harbor
+    if payload.get('type') in ('PUSH_ARTIFACT', 'pushImage'):
+        for resource in payload.get('event_data', {}).get('resources', []):
+            if resource.get('resource_url'):
+                images.add(normalize_image(resource['resource_url']))
+
+    # Docker Hub
+    if payload.get('push_data', {}).get('tag') and payload.get('repository', {}).get('repo_name'):
+        images.add(normalize_image(f"{payload['repository']['repo_name']}:{payload['push_data']['tag']}"))
+
+    return images
+
+
+class PushReceiver():
+    """
+    Listens for registry push notifications and calls `callback(images)` with the pushed images. Notifications
+    arriving within `delay` seconds of each other are handled together.
+    """
+
+    def __init__(self, port: int, callback, token: str = None, delay: int = 2):
+        self.port = port
+        self.callback = callback
+        self.token = token
+        self.delay = delay
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def start(self):
+        """ starts the HTTP listener and the worker in the background """
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ handles a single notification """
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """ accepts the notification and queues the pushed images """
+                status = receiver.handle(self.headers, self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                log.debug('%s: ' + format, self.address_string(), *args)
+
+        server = ThreadingHTTPServer(('', self.port), Handler)
+        threading.Thread(target=server.serve_forever, name='cioban-push-receiver', daemon=True).start()
+        threading.Thread(target=self.__work, name='cioban-push-worker', daemon=True).start()
+        log.info(f'Listening for registry notifications on port {self.port}')
+
+    def handle(self, headers, body: bytes) -> int:
+        """ validates a notification and returns the HTTP status code for it """
+        if self.token:
+            authorization = headers.get('Authorization', '')
+            if not any(hmac.compare_digest(authorization, value) for value in (self.token, f'Bearer {self.token}')):
+                log.warning('Rejected a registry notification with an invalid token')
+                return 401
+        try:
+            images = parse_notification(json.loads(body))
+        except (ValueError, AttributeError) as e:
+            log.warning(f'Could not parse the registry notification. The error: {e}')
+            return 400
+
+        if images:
+            log.info(f"Received a push notification for {', '.join(sorted(images))}")
+            with self.lock:
+                self.pending.update(images)
+            self.event.set()
+        return 202
+
+    def __work(self):
+        """ hands the pushed images to the callback, one batch at a time """
+        while True:
+            self.event.wait()
+            time.sleep(self.delay)
+            with self.lock:
+                self.event.clear()
+                images, self.pending = self.pending, set()
+            try:
+                self.callback(images)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f'Failed to handle the pushed images. The error: {e}')
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" A minimal client for the OCI distribution API, used to resolve image digests without the docker daemon """
+
+import base64
+import json
+import logging
+import re
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from . import constants
+from .helpers import parse_image
+from .ratelimit import parse_retry_after
+
+log = logging.getLogger('cioban')
+
+
+class RegistryError(Exception):
+    """ Raised when the registry doesn't return a digest """
+
+
+class RegistryRateLimited(RegistryError):
+    """ Raised when the registry answers with HTTP 429. `retry_after` is in seconds, `None` if not sent """
+
+    def __init__(self, message: str, retry_after=None):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class RegistryClient():
+    """
+    Resolves the digests with `HEAD /v2/<name>/manifests/<tag>`, through a keep-alive session with a connection pool
+    per registry host. The credentials are read from the docker config file and the bearer tokens are cached until they
+    expire. The remaining quota reported by the registry (`RateLimit-Remaining`) is passed to `throttle`, if set.
+    """
+    manifest_types = [
+        'application/vnd.oci.image.index.v1+json',
+        'application/vnd.docker.distribution.manifest.list.v2+json',
+        'application/vnd.oci.image.manifest.v1+json',
+        'application/vnd.docker.distribution.manifest.v2+json',
+    ]
+    hosts = {
+        'docker.io': 'registry-1.docker.io',
+    }
+    config_hosts = {
+        'docker.io': 'https://index.docker.io/v1/',
+    }
+    headers = {
+        'User-Agent': f'cioban {constants.VERSION}-{constants.BUILD}',
+        'Accept': ', '.join(manifest_types),
+    }
+    pool_hosts = 100
+
+    def __init__(self, config_path: str = None, insecure_registries: list = None, pool_size: int = 10, timeout=10,
+                 throttle=None):
+        self.throttle = throttle
+        self.insecure_registries = insecure_registries or []
+        self.timeout = timeout
+        self.credentials = self.load_credentials(config_path) if config_path else {}
+        # the adapter keeps a pool of up to `pool_size` connections for each of the last `pool_hosts` registry hosts
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self.headers)
+        self.tokens = {}
+        self.etags = {}
+
+    def load_credentials(self, config_path: str) -> dict:
+        """ reads the `auths` section of the docker config file """
+        credentials = {}
+        try:
+            with open(config_path, encoding='utf-8') as config_file:
+                config = json.load(config_file)
+        except FileNotFoundError:
+            log.debug('%s not found. Using anonymous registry access.', config_path)
+            return credentials
+        except (OSError, ValueError) as e:
+            log.warning(f'Could not read {config_path}. The error: {e}')
+            return credentials
+
+        for host, auth in config.get('auths', {}).items():
+            if auth.get('identitytoken'):
+                credentials[host] = {'identitytoken': auth['identitytoken']}
+            elif auth.get('auth'):
+                try:
+                    username, password = base64.b64decode(auth['auth']).decode('utf-8').split(':', 1)
+                except ValueError:
+                    log.warning(f'Could not decode the credentials for {host} in {config_path}')
+                    continue
+                credentials[host] = {'username': username, 'password': password}
+        if config.get('credsStore') or config.get('credHelpers'):
+            log.warning(f'Credential helpers configured in {config_path} are not supported by the registry client')
+        return credentials
+
+    def get_digest(self, image: str) -> str:
+        """ returns the digest of the image, as reported by the registry """
+        registry, repository, tag = parse_image(image)
+        scheme = 'http' if registry in self.insecure_registries else 'https'
+        host = self.hosts.get(registry, registry)
+        url = f'{scheme}://{host}/v2/{repository}/manifests/{tag}'
+
+        headers = {}
+        token = self.__get_cached_token(host, repository)
+        if token:
+            headers['Authorization'] = token
+        cached = self.etags.get(url)
+        if cached:
+            headers['If-None-Match'] = cached[0]
+
+        response = self.session.head(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 401:
+            headers['Authorization'] = self.__authenticate(registry, host, repository, response)
+            response = self.session.head(url, headers=headers, timeout=self.timeout)
+
+        if self.throttle and response.headers.get('RateLimit-Remaining'):
+            # for example `76;w=21600`
+            remaining = response.headers['RateLimit-Remaining'].split(';', 1)[0]
+            if remaining.isdigit():
+                self.throttle.observe(registry, int(remaining))
+        if response.status_code == 429:
+            raise RegistryRateLimited(
+                f'{url} returned HTTP 429',
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            )
+
+        if response.status_code == 304 and cached:
+            log.debug('%s: Manifest not modified', image)
+            return cached[1]
+        if response.status_code != 200:
+            raise RegistryError(f'{url} returned HTTP {response.status_code}')
+
+        digest = response.headers.get('Docker-Content-Digest')
+        if not digest:
+            raise RegistryError(f'{url} did not return a Docker-Content-Digest header')
+        if response.headers.get('ETag'):
+            self.etags[url] = (response.headers['ETag'], digest)
+        return digest
+
+    def __get_cached_token(self, host: str, repository: str):
+        """ returns the Authorization header for the repository, if it's still valid """
+        cached = self.tokens.get((host, repository))
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def __authenticate(self, registry, host, repository, response) -> str:
+        """ answers the WWW-Authenticate challenge and returns the Authorization header """
+        challenge = response.headers.get('WWW-Authenticate', '')
+        scheme = challenge.split(' ', 1)[0].lower()
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        credentials = self.credentials.get(self.config_hosts.get(registry, registry), {})
+
+        if scheme == 'basic':
+            if not credentials.get('username'):
+                raise RegistryError(f'{host} requires basic authentication, but no credentials are configured')
+            auth = base64.b64encode(f"{credentials['username']}:{credentials['password']}".encode('utf-8'))
+            authorization = f"Basic {auth.decode('utf-8')}"
+            expires_in = 3600
+        elif scheme == 'bearer' and params.get('realm'):
+            authorization, expires_in = self.__get_token(params, credentials, repository)
+        else:
+            raise RegistryError(f'{host} returned an unsupported authentication challenge: {challenge}')
+
+        # renew a bit early, so the token doesn't expire between the check and the request
+        self.tokens[(host, repository)] = (authorization, time.monotonic() + max(expires_in - 5, 1))
+        return authorization
+
+    def __get_token(self, params: dict, credentials: dict, repository: str) -> tuple:
+        """ requests a bearer token from the `realm` of the challenge. Returns the Authorization header and its TTL """
+        query = {'service': params.get('service'), 'scope': params.get('scope', f'repository:{repository}:pull')}
+        if credentials.get('identitytoken'):
+            response = self.session.post(params['realm'], timeout=self.timeout, data={
+                **query,
+                'grant_type': 'refresh_token',
+                'refresh_token': credentials['identitytoken'],
+                'client_id': 'cioban',
+            })
+        else:
+            auth = (credentials['username'], credentials['password']) if credentials.get('username') else None
+            response = self.session.get(params['realm'], params=query, auth=auth, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RegistryError(f"{params['realm']} returned HTTP {response.status_code}")
+        token = response.json()
+        return f"Bearer {token.get('token') or token.get('access_token')}", int(token.get('expires_in', 60))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Starts the service updates and tracks their convergence """
+
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+import pause
+import requests
+import docker
+from . import prometheus
+from .trace import Tracer
+
+log = logging.getLogger('cioban')
+
+
+@dataclass
+class Update():
+    """
+    A service update tracked during the rollout. `service` is the `ServiceRecord`, `old_image` and `new_image` are the
+    images with digest. Once the update has finished, `state` is the outcome and `duration` the seconds it took.
+
+    The updates of the same `group` (by default the image) are rolled out together, by increasing `order`.
+    """
+    service: object
+    old_image: str
+    new_image: str
+    group: str = None
+    order: int = 0
+    state: str = None
+    duration: float = None
+
+    def __post_init__(self):
+        self.group = self.group or self.image
+
+    @property
+    def image(self) -> str:
+        """ the image of the service, without digest """
+        return self.old_image.split('@', 1)[0]
+
+
+@dataclass
+class Poll():
+    """
+    A started update, polled every `interval` seconds, with the interval growing after every poll. `model` is the full
+    docker service fetched to start the update, it's only kept while the update is in progress. `errors` counts the
+    polls that failed in a row.
+    """
+    update: Update
+    model: object
+    started: float
+    next_poll: float
+    interval: float
+    errors: int = 0
+
+
+@dataclass
+class Rollout():
+    """
+    Runs up to `max_concurrent` service updates at the same time. The convergence of all the started updates is
+    polled together, with a growing interval between the polls of the same service.
+
+    The updates are taken group by group, in the order they are passed. If `group_concurrency` is set, at most that
+    many updates of a group run at the same time and the free slots go to the next groups. An update only starts once
+    the updates of its group with a lower `order` have finished.
+    """
+    max_concurrent: int = 1
+    timeout: int = 0
+    group_concurrency: int = 0
+    tracer: Tracer = None
+    poll_interval = 1
+    poll_backoff = 1.5
+    poll_interval_max = 15
+    poll_errors_max = 10
+    updating_states = ('updating', 'rollback_started')
+    failed_states = ('paused', 'rollback_paused', 'rollback_completed')
+
+    def __post_init__(self):
+        self.max_concurrent = max(self.max_concurrent or 1, 1)
+        self.tracer = self.tracer or Tracer()
+
+    def run(self, updates: list, start, converged, failed):
+        """
+        Rolls out the updates, in order
+        :param updates: A list of `Update`
+        :param start: Called with the service and the new image. Returns the updated docker service model or `None`
+        :param converged: Called with the `Update` and the docker service model, once the service has converged
+        :param failed: Called with the `Update` if the service can't converge. The reason is in `Update.state`
+        """
+        groups = {}
+        for update in updates:
+            groups.setdefault(update.group, deque()).append(update)
+        remaining = len(updates)
+        running = Counter()
+        active = []
+        while remaining or active:
+            prometheus.PROM_PENDING_UPDATES.set(remaining + len(active))
+            while remaining and len(active) < self.max_concurrent:
+                group = self.__next_group(groups, running, active)
+                if group is None:
+                    break
+                update = groups[group].popleft()
+                if not groups[group]:
+                    del groups[group]
+                remaining -= 1
+                model = start(update.service, update.new_image)
+                if model:
+                    now = time.monotonic()
+                    running[update.group] += 1
+                    active.append(Poll(update, model, started=now, next_poll=now, interval=self.poll_interval))
+
+            if not active:
+                continue
+
+            delay = min(poll.next_poll for poll in active) - time.monotonic()
+            if delay > 0:
+                pause.seconds(delay)
+
+            now = time.monotonic()
+            for poll in [poll for poll in active if poll.next_poll <= now]:
+                if not self.__traced_poll(poll, now):
+                    continue
+                active.remove(poll)
+                running[poll.update.group] -= 1
+                poll.update.duration = now - poll.started
+                if poll.update.state == 'converged':
+                    converged(poll.update, poll.model)
+                else:
+                    failed(poll.update)
+        prometheus.PROM_PENDING_UPDATES.set(0)
+
+    def __next_group(self, groups: dict, running: Counter, active: list):
+        """ returns the first group with an update that can start now, or `None` """
+        for group, pending in groups.items():
+            if self.group_concurrency and running[group] >= self.group_concurrency:
+                continue
+            order = pending[0].order
+            if any(poll.update.group == group and poll.update.order < order for poll in active):
+                continue
+            return group
+        return None
+
+    def __traced_poll(self, poll: Poll, now: float) -> bool:
+        """ polls the update, recording it as a span of the trace """
+        with self.tracer.span('poll', service=poll.update.service.name, image=poll.update.new_image) as span:
+            finished = self.__poll(poll, now)
+            span.set(outcome=poll.update.state or 'updating')
+        return finished
+
+    def __poll(self, poll: Poll, now: float) -> bool:
+        """ reloads the service and returns `True` if it's not updating anymore """
+        update = poll.update
+        service_name = update.service.name
+        if not self.__reload(poll, now):
+            return update.state is not None
+
+        state = (poll.model.attrs.get('UpdateStatus') or {}).get('State')
+        if state in self.failed_states:
+            update.state = state
+            return True
+
+        if state in self.updating_states:
+            if self.timeout and now - poll.started > self.timeout:
+                update.state = 'timeout'
+                return True
+            log.debug('Service %s is in status `%s`. Waiting %.1fs...', service_name, state, poll.interval)
+            self.__backoff(poll, now)
+            return False
+
+        log.debug('Service %s has converged.', service_name)
+        update.state = 'converged'
+        return True
+
+    def __reload(self, poll: Poll, now: float) -> bool:
+        """
+        reloads the service. If it fails, the poll is retried later, unless the service is gone or the polls failed
+        `poll_errors_max` times in a row. Then the reason is in `Update.state`
+        :return: `True` if the service has been reloaded
+        """
+        try:
+            poll.model.reload()
+        except docker.errors.NotFound:
+            poll.update.state = 'disappeared'
+            return False
+        except (docker.errors.APIError, requests.exceptions.RequestException) as error:
+            poll.errors += 1
+            if poll.errors >= self.poll_errors_max:
+                poll.update.state = 'poll_failed'
+            else:
+                log.warning(f'Cannot poll {poll.update.service.name}. Retrying in {poll.interval:.1f}s. Error: {error}')
+                self.__backoff(poll, now)
+            return False
+        poll.errors = 0
+        return True
+
+    def __backoff(self, poll: Poll, now: float):
+        """ schedules the next poll and grows the interval """
+        poll.next_poll = now + poll.interval
+        poll.interval = min(poll.interval * self.poll_backoff, self.poll_interval_max)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Schedules the checks of every service """
+
+import heapq
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from cronsim import CronSim, CronSimError
+from .helpers import parse_duration
+
+log = logging.getLogger('cioban')
+
+
+class Scheduler():
+    """
+    Keeps the next check time of every service in a heap. The interval comes from the service label
+    `cioban.check.interval` or the cron schedule from `cioban.check.schedule`, falling back to the global `interval`
+    or `schedule`. Up to `jitter` seconds are added to every check time, to spread the registry lookups.
+    """
+    interval_label = 'cioban.check.interval'
+    schedule_label = 'cioban.check.schedule'
+
+    def __init__(self, interval: int, schedule: str = None, jitter: int = 0):
+        # the global (interval, schedule), for the services without labels
+        self.default = (interval, schedule)
+        self.jitter = jitter
+        self.heap = []
+        self.due = {}
+        self.timing = {}
+        self.restored = {}
+        self.lock = threading.Lock()
+
+    def sync(self, services: list):
+        """ schedules the new services and forgets the services that are gone """
+        now = time.time()
+        with self.lock:
+            current = set()
+            for service in services:
+                current.add(service.id)
+                self.timing[service.id] = self.__get_timing(service)
+                if service.id in self.restored:
+                    # the interval might have been shortened since the state was saved
+                    due = min(self.restored[service.id], self.__next_time(self.timing[service.id], now))
+                    self.__push_at(service.id, due)
+                elif service.id not in self.due:
+                    self.__push(service.id, now)
+            for service_id in [service_id for service_id in self.due if service_id not in current]:
+                del self.due[service_id]
+                del self.timing[service_id]
+            self.restored = {}
+
+    def reschedule(self, service_ids):
+        """ schedules the next check of the services """
+        now = time.time()
+        with self.lock:
+            for service_id in service_ids:
+                if service_id in self.timing:
+                    self.__push(service_id, now)
+
+    def defer(self, deferred: dict):
+        """ schedules the services (ID to timestamp) for a check at the given time, for example after a rate limit """
+        with self.lock:
+            for service_id, due in deferred.items():
+                if service_id in self.timing:
+                    if self.jitter:
+                        due += random.uniform(0, self.jitter)
+                    self.__push_at(service_id, due)
+
+    def dump(self) -> dict:
+        """ returns the service IDs with the timestamp of their next check """
+        with self.lock:
+            return {**self.restored, **self.due}
+
+    def restore(self, due: dict):
+        """ uses the check times from `dump()` for the services, once they are synced """
+        with self.lock:
+            self.restored = dict(due)
+
+    def next_due(self):
+        """ returns the timestamp of the next due check or `None` if no service is scheduled """
+        with self.lock:
+            self.__drop_stale()
+            return self.heap[0][0] if self.heap else None
+
+    def default_due(self) -> float:
+        """ returns the timestamp of the next check based on the global settings """
+        return self.__next_time(self.default, time.time())
+
+    def pop_due(self, grace: float = 1) -> set:
+        """ returns the IDs of the services due within `grace` seconds and removes them from the heap """
+        limit = time.time() + grace
+        due = set()
+        with self.lock:
+            self.__drop_stale()
+            while self.heap and self.heap[0][0] <= limit:
+                _, service_id = heapq.heappop(self.heap)
+                del self.due[service_id]
+                due.add(service_id)
+                self.__drop_stale()
+        return due
+
+    def __push(self, service_id: str, now: float):
+        """ adds the next check of the service to the heap """
+        due = self.__next_time(self.timing[service_id], now)
+        if self.jitter:
+            due += random.uniform(0, self.jitter)
+        self.__push_at(service_id, due)
+
+    def __push_at(self, service_id: str, due: float):
+        """ adds the check of the service at `due` to the heap """
+        self.due[service_id] = due
+        heapq.heappush(self.heap, (due, service_id))
+
+    def __drop_stale(self):
+        """ drops the heap entries of services that have been rescheduled or removed """
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def __get_timing(self, service) -> tuple:
+        """ returns the (interval, schedule) of the service """
+        labels = service.labels
+        if labels.get(self.schedule_label):
+            try:
+                CronSim(labels[self.schedule_label], datetime.now())
+                return None, labels[self.schedule_label]
+            except CronSimError as e:
+                log.warning(f'{service.name}: {self.schedule_label} not understood. Ignoring it. The error: {e}')
+        if labels.get(self.interval_label):
+            try:
+                return parse_duration(labels[self.interval_label]), None
+            except ValueError as e:
+                log.warning(f'{service.name}: {self.interval_label} not understood. Ignoring it. The error: {e}')
+        return self.default
+
+    @staticmethod
+    def __next_time(timing: tuple, now: float) -> float:
+        """ returns the timestamp of the next check for the (interval, schedule) """
+        interval, schedule = timing
+        if schedule:
+            return next(CronSim(schedule, datetime.fromtimestamp(now))).timestamp()
+        return now + interval
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Selects the services cioban takes care of, from `FILTER_SERVICES` and `BLACKLIST_SERVICES` """
+
+import fnmatch
+import logging
+import re
+
+log = logging.getLogger('cioban')
+
+# the label docker sets on the services deployed with `docker stack deploy`
+STACK_LABEL = 'com.docker.stack.namespace'
+
+
+def is_regex(value: str) -> bool:
+    """ `True` if the value is a regular expression between slashes """
+    return len(value) > 2 and value.startswith('/') and value.endswith('/')
+
+
+def is_pattern(value: str) -> bool:
+    """ `True` if the value is a glob or a regular expression instead of a plain name """
+    return is_regex(value) or any(char in value for char in '*?[')
+
+
+def compile_patterns(values, prefix: bool = False):
+    """
+    compiles names into a single regular expression, so a name is matched against all of them at once. A value can be
+    a regular expression between slashes (`/^web-[0-9]+$/`), a glob (`web-*`) or a plain name. Use the `match()` of
+    the result: the globs and the plain names have to match the whole name, the regular expressions any part of it.
+    :param prefix: If set, a plain name also matches the names starting with it, like the `docker service ls` filters
+    :return: The compiled expression or `None` if there are no values
+    """
+    patterns = []
+    for value in values:
+        if is_regex(value):
+            try:
+                re.compile(value[1:-1])
+            except re.error as e:
+                raise ValueError(f'{value} is not a valid regular expression. The error: {e}') from e
+            patterns.append(f'.*?(?:{value[1:-1]})')
+        elif is_pattern(value):
+            patterns.append(fnmatch.translate(value))
+        else:
+            patterns.append(re.escape(value) + ('' if prefix else r'\Z'))
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+
+def parse_filters(filters) -> list:
+    """
+    returns the filters as a list of (key, value) tuples
+    :param filters: A dict, a list of (key, value) tuples or a list of `key=value` strings
+    """
+    if isinstance(filters, dict):
+        return list(filters.items())
+    parsed = []
+    for item in filters or []:
+        if isinstance(item, str):
+            key, has_value, value = item.partition('=')
+            if not has_value or not value:
+                raise ValueError(f'{item} not understood for FILTER_SERVICES')
+            item = (key, value)
+        parsed.append(tuple(item))
+    return parsed
+
+
+class Selector():
+    """
+    The `FILTER_SERVICES` filters and the `BLACKLIST_SERVICES` names, compiled once. Checking a service is a single
+    pass over its name, ID, mode and labels.
+
+    Like with `docker service ls`, a service has to match all the `label` filters and at least one of the filters of
+    every other kind (`name`, `id`, `mode` and `stack`). `name`, the blacklist and the label values also take globs and
+    regular expressions between slashes.
+    """
+    def __init__(self, filters=None, blacklist=None):
+        filters = parse_filters(filters)
+        names = []
+        ids = []
+        modes = set()
+        stacks = set()
+        self.labels = []
+        for key, value in filters:
+            if key == 'name':
+                names.append(value)
+            elif key == 'id':
+                ids.append(value)
+            elif key == 'mode':
+                # `replicated-job` is `ReplicatedJob` in the spec
+                modes.add(''.join(part.capitalize() for part in value.split('-')))
+            elif key == 'stack':
+                stacks.add(value)
+            elif key == 'label':
+                label, has_value, label_value = value.partition('=')
+                pattern = None
+                if has_value:
+                    pattern = compile_patterns([label_value])
+                self.labels.append((label, pattern))
+            else:
+                log.warning(f'Filter `{key}` is not supported. Ignoring it.')
+
+        self.names = compile_patterns(names, prefix=True)
+        self.ids = tuple(ids)
+        self.modes = modes
+        self.stacks = stacks
+        blacklist = list(blacklist or [])
+        self.blacklist = {name for name in blacklist if not is_pattern(name)}
+        self.blacklist_pattern = compile_patterns([name for name in blacklist if is_pattern(name)])
+
+    @property
+    def label_keys(self) -> frozenset:
+        """ the labels a `ServiceRecord` has to keep for the selection """
+        return frozenset([label for label, _ in self.labels] + ([STACK_LABEL] if self.stacks else []))
+
+    def blacklisted(self, service) -> bool:
+        """ `True` if the name of the service is in `BLACKLIST_SERVICES` """
+        if service.name in self.blacklist:
+            return True
+        return bool(self.blacklist_pattern and self.blacklist_pattern.match(service.name))
+
+    def select(self, service) -> bool:
+        """ `True` if the service matches the filters and is not blacklisted """
+        if self.blacklisted(service):
+            log.debug('Blacklisted %s', service.name)
+            return False
+        return bool(
+            (not self.names or self.names.match(service.name))
+            and (not self.ids or service.id.startswith(self.ids))
+            and (not self.modes or service.mode in self.modes)
+            and (not self.stacks or service.labels.get(STACK_LABEL) in self.stacks)
+            and all(self.label_matches(service, label, pattern) for label, pattern in self.labels)
+        )
+
+    @staticmethod
+    def label_matches(service, label: str, pattern) -> bool:
+        """ `True` if the service has the label and, with a `pattern`, its value matches """
+        value = service.labels.get(label)
+        return value is not None and (pattern is None or bool(pattern.match(value)))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" A compact record of a swarm service """
+
+# labels with this prefix are always kept, they configure cioban
+LABEL_PREFIX = 'cioban.'
+
+
+class ServiceRecord():
+    """
+    The fields cioban reads from a swarm service, built from the JSON of the docker API. Only the `cioban.*` labels
+    and the labels in `label_keys` are kept, the rest of the spec is dropped.
+
+    To update the service, the full `docker.models.services.Service` has to be fetched.
+    """
+    __slots__ = ('id', 'name', 'version', 'image', 'labels', 'mode', 'update_state')
+
+    def __init__(self, attrs: dict, label_keys=frozenset()):
+        spec = attrs['Spec']
+        self.id = attrs['ID']
+        self.name = spec['Name']
+        self.version = attrs.get('Version', {}).get('Index', 0)
+        self.image = spec['TaskTemplate']['ContainerSpec']['Image']
+        self.labels = {
+            key: value for key, value in (spec.get('Labels') or {}).items()
+            if key.startswith(LABEL_PREFIX) or key in label_keys
+        }
+        self.mode = next(iter(spec.get('Mode') or {}), None)
+        self.update_state = (attrs.get('UpdateStatus') or {}).get('State')
+
+    @property
+    def short_id(self) -> str:
+        """ the ID, shortened the same way docker does it """
+        return self.id[:12]
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.short_id} {self.name}>'
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Keeps the state of cioban on disk, so a restart resumes where the previous process stopped """
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger('cioban')
+
+
+class StateStore():
+    """
+    Remembers when every service has last been checked and updated, and writes them to `path` together with the
+    sections passed to `save()`. The file is replaced atomically, so a crash while writing keeps the previous state.
+    """
+    version = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.services = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> dict:
+        """ reads the state file and returns its content. Returns an empty state if there's no usable file """
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            log.debug('%s not found. Starting without a previous state.', self.path)
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f'Could not read the state from {self.path}. Starting without it. The error: {e}')
+            return {}
+
+        if not isinstance(state, dict) or state.get('version') != self.version:
+            log.warning(f'{self.path} has an unknown format. Starting without a previous state.')
+            return {}
+        with self.lock:
+            self.services = {
+                service_id: {'checked': times.get('checked'), 'updated': times.get('updated')}
+                for service_id, times in state.get('services', {}).items()
+            }
+        log.info(f"Loaded the state of {len(self.services)} services, saved {time.ctime(state.get('saved', 0))}")
+        return state
+
+    def checked(self, service_ids):
+        """ remembers that the services have been checked now """
+        now = time.time()
+        with self.lock:
+            for service_id in service_ids:
+                self.services.setdefault(service_id, {'checked': None, 'updated': None})['checked'] = now
+
+    def updated(self, service_id: str):
+        """ remembers that the service has been updated now """
+        with self.lock:
+            self.services.setdefault(service_id, {'checked': None, 'updated': None})['updated'] = time.time()
+
+    def save(self, due: dict, digests: dict, next_run: float = None):
+        """
+        writes the state file
+        :param due: The service IDs with the timestamp of their next check. The other services are forgotten
+        :param digests: The digest cache, as returned by `DigestCache.dump()`
+        :param next_run: The timestamp of the next run
+        """
+        with self.lock:
+            self.services = {service_id: times for service_id, times in self.services.items() if service_id in due}
+            services = {
+                service_id: {**self.services.get(service_id, {'checked': None, 'updated': None}), 'due': due_time}
+                for service_id, due_time in due.items()
+            }
+        state = {
+            'version': self.version,
+            'saved': time.time(),
+            'next_run': next_run,
+            'services': services,
+            'digests': digests,
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temporary = None
+        try:
+            descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.cioban-state-')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as state_file:
+                json.dump(state, state_file, separators=(',', ':'))
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(temporary, self.path)
+        except OSError as e:
+            log.error(f'Could not save the state to {self.path}. The error: {e}')
+            if temporary and os.path.exists(temporary):
+                os.unlink(temporary)
+            return
+        log.debug('Saved the state of %s services to %s', len(services), self.path)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Serves the status of the services as JSON, next to the prometheus metrics """
+
+import json
+import logging
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from prometheus_client import make_wsgi_app
+from prometheus_client.exposition import ThreadingWSGIServer
+
+log = logging.getLogger('cioban')
+
+
+class Status():
+    """
+    Keeps what the runs found out about every service. The JSON document is only rendered again after a change, so
+    polling `/status` never reaches the docker daemon or the registries.
+    """
+    fields = {
+        'name': '',
+        'image': None,
+        'current_digest': None,
+        'registry_digest': None,
+        'update_pending': False,
+        'state': None,
+        'checked': None,
+        'updated': None,
+        'deferred_until': None,
+        'webhook': None,
+    }
+
+    def __init__(self):
+        self.services = {}
+        self.last_run = {'started': None, 'finished': None}
+        # the ETag has to change when cioban restarts, even if the version is the same
+        self.epoch = int(time.time())
+        self.version = 0
+        self.rendered = None
+        self.lock = threading.Lock()
+
+    def __update(self, endpoint: str, service_id: str, **kwargs):
+        """ updates the fields of a service. Has to be called with the lock held """
+        key = (endpoint, service_id)
+        if key not in self.services:
+            self.services[key] = {'endpoint': endpoint, 'id': service_id, **self.fields}
+        self.services[key].update(kwargs)
+        self.version += 1
+
+    def run_started(self):
+        """ remembers the start of a run """
+        with self.lock:
+            self.last_run['started'] = time.time()
+            self.version += 1
+
+    def run_finished(self):
+        """ remembers the end of a run """
+        with self.lock:
+            self.last_run['finished'] = time.time()
+            self.version += 1
+
+    def checked(self, endpoint: str, service, details, registry_digest: str):
+        """
+        records the result of a check
+        :param details: The `ServiceDetails` of the service, with its image, digest and webhook summary
+        :param registry_digest: The digest resolved from the registry or `None` if the lookup failed
+        """
+        with self.lock:
+            self.__update(
+                endpoint,
+                service.id,
+                name=service.name,
+                image=details.image,
+                current_digest=details.digest,
+                registry_digest=registry_digest,
+                update_pending=bool(registry_digest and registry_digest != details.digest),
+                state='lookup_failed' if not registry_digest else None,
+                checked=time.time(),
+                deferred_until=None,
+                webhook=details.webhook,
+            )
+
+    def deferred(self, endpoint: str, service, until: float):
+        """ records that the check of the service has been deferred """
+        with self.lock:
+            self.__update(endpoint, service.id, name=service.name, state='deferred', deferred_until=until)
+
+    def updated(self, endpoint: str, service_id: str, digest: str):
+        """ records that the service has converged with the new digest """
+        with self.lock:
+            self.__update(
+                endpoint,
+                service_id,
+                current_digest=digest,
+                update_pending=False,
+                state='converged',
+                updated=time.time(),
+            )
+
+    def failed(self, endpoint: str, service_id: str, state: str):
+        """ records that the update of the service failed. The update stays pending """
+        with self.lock:
+            self.__update(endpoint, service_id, state=state)
+
+    def remove(self, endpoint: str, service_id: str):
+        """ forgets a service that doesn't exist anymore """
+        with self.lock:
+            if self.services.pop((endpoint, service_id), None):
+                self.version += 1
+
+    def retain(self, endpoint: str, service_ids):
+        """ forgets the services of the endpoint that are not in `service_ids` anymore """
+        service_ids = set(service_ids)
+        with self.lock:
+            for key in [key for key in self.services if key[0] == endpoint and key[1] not in service_ids]:
+                del self.services[key]
+                self.version += 1
+
+    def render(self) -> tuple:
+        """ returns the JSON document and its version, rendering it only if something changed """
+        with self.lock:
+            if not self.rendered or self.rendered[1] != self.version:
+                services = sorted(self.services.values(), key=lambda service: (service['endpoint'], service['name']))
+                document = {'last_run': self.last_run, 'services': services}
+                self.rendered = (json.dumps(document).encode('utf-8'), self.version)
+            return self.rendered
+
+    def app(self, environ, start_response):
+        """ the WSGI application for `/status`. Answers with HTTP 304 if the `ETag` still matches """
+        body, version = self.render()
+        etag = f'"{self.epoch}-{version}"'
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', [('ETag', etag)])
+            return [b'']
+        start_response('200 OK', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('ETag', etag),
+            ('Cache-Control', 'no-cache'),
+        ])
+        return [body]
+
+
+class SilentHandler(WSGIRequestHandler):
+    """ doesn't log every request """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def start_server(port: int, status: Status):
+    """ serves `/status` and the prometheus metrics on all the other paths, in a background thread """
+    metrics = make_wsgi_app()
+
+    def route(environ, start_response):
+        if environ.get('PATH_INFO', '/').rstrip('/') == '/status':
+            return status.app(environ, start_response)
+        return metrics(environ, start_response)
+
+    server = make_server('', port, route, ThreadingWSGIServer, handler_class=SilentHandler)
+    threading.Thread(target=server.serve_forever, name='cioban-http', daemon=True).start()
+    return server
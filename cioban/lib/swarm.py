@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The docker endpoints managed by cioban """
+
+import logging
+import threading
+from dataclasses import InitVar, dataclass, field
+import docker
+from .helpers import strtobool
+from .inventory import Inventory
+from .selector import Selector
+
+log = logging.getLogger('cioban')
+
+
+@dataclass
+class Swarm():
+    """
+    A docker endpoint, with its own client and service inventory. If no `connection` is passed, the client is connected
+    on first use, with `client_kwargs` for `docker.DockerClient` or from the environment.
+    """
+    name: str
+    connection: object = None
+    client_kwargs: dict = None
+    selector: InitVar[Selector] = None
+    inventory: Inventory = field(init=False)
+    # the time of the last full listing of the services
+    listed: float = field(init=False, default=0)
+    lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    def __post_init__(self, selector):
+        self.inventory = Inventory(endpoint=self.name, selector=selector)
+
+    @property
+    def client(self):
+        """ the docker client of the endpoint """
+        with self.lock:
+            if self.connection is None:
+                if self.client_kwargs:
+                    log.debug("Connecting to %s (%s)", self.name, self.client_kwargs['base_url'])
+                    self.connection = docker.DockerClient(**self.client_kwargs)
+                else:
+                    log.debug('Connecting to %s from the environment', self.name)
+                    self.connection = docker.from_env()
+            return self.connection
+
+
+def parse_endpoint(endpoint: str) -> tuple:
+    """
+    Parses an endpoint in the form `name=url[,cert_path=/path][,tls_verify=yes]`
+    :return: A tuple of (name, the keyword arguments for `docker.DockerClient`)
+    """
+    name, _, options = endpoint.partition('=')
+    url, *params = options.split(',')
+    if not name or not url:
+        raise ValueError(f'{endpoint} not understood for DOCKER_ENDPOINTS')
+
+    environment = {'DOCKER_HOST': url}
+    for param in params:
+        key, _, value = param.partition('=')
+        if key == 'cert_path':
+            environment['DOCKER_CERT_PATH'] = value
+        elif key == 'tls_verify':
+            if strtobool(value):
+                environment['DOCKER_TLS_VERIFY'] = '1'
+        else:
+            raise ValueError(f'{key} not understood for the endpoint {name}')
+    return name, docker.utils.kwargs_from_env(environment=environment)
+
+
+def connect(endpoints: list, selector: Selector = None) -> list:
+    """
+    returns a `Swarm` for every endpoint in the form `name=url[,cert_path=/path][,tls_verify=yes]`. The endpoints are
+    connected on first use
+    """
+    swarms = []
+    for endpoint in endpoints:
+        name, kwargs = parse_endpoint(endpoint)
+        if name in [swarm.name for swarm in swarms]:
+            raise ValueError(f'The endpoint {name} is defined more than once')
+        swarms.append(Swarm(name, client_kwargs=kwargs, selector=selector))
+    return swarms
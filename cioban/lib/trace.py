@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Records the operations of a run as spans and writes them to a trace file """
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+log = logging.getLogger('cioban')
+
+
+@dataclass
+class Span():
+    """ A timed operation, with the service, image and outcome it's about in `attrs` """
+    name: str
+    attrs: dict
+    start: float = None
+    duration: float = None
+    thread: threading.Thread = None
+
+    def set(self, **attrs):
+        """ adds attributes to the span, for example the outcome """
+        self.attrs.update(attrs)
+
+
+class NullSpan():
+    """ What `Tracer.span()` returns when tracing is disabled. Does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        """ ignores the attributes """
+
+
+NULL_SPAN = NullSpan()
+
+
+class SpanContext():
+    """ Times a span and adds it to the run of the tracer """
+    __slots__ = ('tracer', 'span', 'started')
+
+    def __init__(self, tracer, span: Span):
+        self.tracer = tracer
+        self.span = span
+        self.started = None
+
+    def __enter__(self):
+        self.span.start = time.time()
+        self.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.duration = time.perf_counter() - self.started
+        self.span.thread = threading.current_thread()
+        if exc_type and 'outcome' not in self.span.attrs:
+            self.span.attrs['outcome'] = exc_type.__name__
+        self.tracer.add(self.span)
+        return False
+
+
+class Tracer():
+    """
+    Collects the spans of a run and writes them to a new file in `directory` once the run has finished. Only the
+    last `keep` files are kept.
+
+    With `fmt='jsonl'`, every span is a JSON object on its own line. With `fmt='chrome'`, the file is in the Chrome
+    trace event format and can be opened in `chrome://tracing` or https://ui.perfetto.dev.
+
+    Without `directory`, tracing is disabled and `span()` returns a shared object that does nothing.
+    """
+    formats = {'jsonl': 'jsonl', 'chrome': 'json'}
+
+    def __init__(self, directory: str = None, fmt: str = 'jsonl', keep: int = 10):
+        if fmt not in self.formats:
+            raise ValueError(f'{fmt} not understood for TRACE_FORMAT. Use one of: {", ".join(self.formats)}')
+        self.directory = directory
+        self.fmt = fmt
+        self.keep = keep
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """ `True` if the spans are recorded """
+        return bool(self.directory)
+
+    def span(self, name: str, **attrs):
+        """ returns a context manager timing the operation `name`. The span is passed to the `with` block """
+        if not self.directory:
+            return NULL_SPAN
+        return SpanContext(self, Span(name, attrs))
+
+    def add(self, span: Span):
+        """ adds a finished span to the run """
+        with self.lock:
+            self.spans.append(span)
+
+    def start_run(self):
+        """ forgets the spans of the previous run """
+        with self.lock:
+            self.spans = []
+
+    def finish_run(self):
+        """ writes the spans of the run to a new trace file and removes the oldest files """
+        if not self.directory:
+            return
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+
+        started = min(span.start for span in spans)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+        name = f'cioban-trace-{stamp}-{int(started * 1000) % 1000:03d}.{self.formats[self.fmt]}'
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as trace_file:
+                if self.fmt == 'chrome':
+                    json.dump(self.chrome(spans), trace_file, separators=(',', ':'))
+                else:
+                    for span in spans:
+                        trace_file.write(json.dumps(self.jsonl(span), separators=(',', ':')) + '\n')
+        except OSError as e:
+            log.error(f'Could not write the trace to {path}. The error: {e}')
+            return
+        log.debug('Wrote %s spans to %s', len(spans), path)
+        self.rotate()
+
+    def rotate(self):
+        """ removes the oldest trace files, keeping `keep` files """
+        try:
+            traces = sorted(name for name in os.listdir(self.directory) if name.startswith('cioban-trace-'))
+        except OSError as e:
+            log.warning(f'Could not list the traces in {self.directory}. The error: {e}')
+            return
+        for name in traces[:max(len(traces) - self.keep, 0)]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError as e:
+                log.warning(f'Could not remove the trace {name}. The error: {e}')
+
+    @staticmethod
+    def jsonl(span: Span) -> dict:
+        """ returns the span as a JSON line """
+        return {
+            'name': span.name,
+            'start': round(span.start, 6),
+            'duration': round(span.duration, 6),
+            'thread': span.thread.name,
+            **span.attrs,
+        }
+
+    @staticmethod
+    def chrome(spans: list) -> dict:
+        """ returns the spans as complete events of the Chrome trace event format """
+        pid = os.getpid()
+        threads = {span.thread.ident: span.thread.name for span in spans}
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident, 'args': {'name': name}}
+            for ident, name in threads.items()
+        ]
+        events.extend(
+            {
+                'name': span.name,
+                'cat': 'cioban',
+                'ph': 'X',
+                'ts': int(span.start * 1000000),
+                'dur': int(span.duration * 1000000),
+                'pid': pid,
+                'tid': span.thread.ident,
+                'args': span.attrs,
+            }
+            for span in spans
+        )
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
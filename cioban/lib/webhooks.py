@@ -2,11 +2,15 @@
 # -*- coding: utf-8 -*-
 """ Handles webhooks """
 import logging
+import queue
+import threading
+import time
 from urllib.parse import urlparse
 import requests
-from docker.client import DockerClient
 from . import constants
+from . import prometheus
 from .helpers import short_msg
+from .service import ServiceRecord
 
 log = logging.getLogger('cioban')
 
@@ -24,6 +28,7 @@ class Webhooks():
         },
         'http.timeout': {
             'default': 2,
+            'type': int,
         },
         'auth.basic.username': {
             'default': None,
@@ -40,9 +45,17 @@ class Webhooks():
         'auth.token.token': {
             'default': None,
         },
+        'retry.count': {
+            'default': 0,
+            'type': int,
+        },
+        'retry.backoff': {
+            'default': 1,
+            'type': float,
+        },
     }
 
-    def __init__(self, service: DockerClient.services):
+    def __init__(self, service: ServiceRecord):
         self.service = service
         self.labels = {}
         self.active = False
@@ -51,12 +64,12 @@ class Webhooks():
     def gather_labels(self, service):
         """ gathers the webhooks for the service """
         for label in self.describe_labels:
-            value = service.attrs['Spec']['Labels'].get(f"cioban.webhook.{label}")
+            value = service.labels.get(f"cioban.webhook.{label}")
             if value:
                 self._update_label(label, value)
         if self.labels.get('http.url'):
             self.active = True
-            log.debug(f'{self.service.name}: Webhook active')
+            log.debug('%s: Webhook active', self.service.name)
 
     def validate_url(self, url: str) -> bool:
         """ Validates if a string is a valid URL """
@@ -82,21 +95,60 @@ class Webhooks():
                     )
                     value = label_definition['default']
 
+            if label_definition.get('type'):
+                try:
+                    converted = label_definition['type'](value)
+                    if converted < 0:
+                        raise ValueError(value)
+                    value = converted
+                except ValueError:
+                    log.warning(
+                        f"{self.service.name}: Value '{value}' for label {label} is invalid."
+                        f" Using '{label_definition['default']}'."
+                    )
+                    value = label_definition['default']
+
             if label == 'http.url' and not self.validate_url(value):
                 log.warning(f"{self.service.name}: Value '{value}' for label {label} is invalid")
             else:
-                log.debug(f"{self.service.name}: Using '{value}' for {label}")
+                log.debug("%s: Using '%s' for %s", self.service.name, value, label)
                 result = {label: value}
                 self.labels.update(result)
 
         return result
 
-    def trigger(self):
-        """ Triggers the webhook """
+    def trigger(self, dispatcher=None):
+        """ Triggers the webhook. If a `Dispatcher` is passed, the webhook is queued and sent in the background """
         if not self.active:
-            log.debug(f"{self.service.name}: Webhook not configured")
+            log.debug("%s: Webhook not configured", self.service.name)
             return
 
+        request = self.prepare()
+        if dispatcher:
+            dispatcher.submit(request)
+        else:
+            send(request)
+
+    def summary(self) -> dict:
+        """ describes the webhook configuration, without the URL path and the credentials """
+        if not self.active:
+            return {'active': False}
+        auth = None
+        if self.labels.get('auth.basic.username') and self.labels.get('auth.basic.password'):
+            auth = 'basic'
+        if self.labels.get('auth.token.token'):
+            auth = 'token' if not auth else f'{auth}+token'
+        return {
+            'active': True,
+            'method': self.labels.get('http.method', self.describe_labels['http.method']['default']),
+            'host': urlparse(self.labels['http.url']).hostname,
+            'auth': auth,
+            # already validated by `_update_label`
+            'retry_count': self.labels.get('retry.count', self.describe_labels['retry.count']['default']),
+        }
+
+    def prepare(self) -> dict:
+        """ Returns everything needed to send the webhook """
         url = self.labels['http.url']
         method = self.labels.get('http.method', self.describe_labels['http.method']['default'])
         timeout = int(self.labels.get('http.timeout', self.describe_labels['http.timeout']['default']))
@@ -119,11 +171,90 @@ class Webhooks():
             headers.update({
                 auth_name: f"{auth_value} {self.labels['auth.token.token']}"
             })
-        action = getattr(requests, method)
 
+        return {
+            'service_name': self.service.name,
+            'method': method,
+            'url': url,
+            'auth': auth,
+            'headers': headers,
+            'timeout': timeout,
+            'retry_count': int(self.labels.get('retry.count', self.describe_labels['retry.count']['default'])),
+            'retry_backoff': float(self.labels.get('retry.backoff', self.describe_labels['retry.backoff']['default'])),
+        }
+
+
+def send(request: dict, session=requests) -> bool:
+    """ Sends a prepared webhook once and returns `True` on success """
+    service_name = request['service_name']
+    action = getattr(session, request['method'])
+    try:
+        with prometheus.PROM_WEBHOOK_SECONDS.time():
+            response = action(
+                request['url'],
+                auth=request['auth'],
+                headers=request['headers'],
+                timeout=request['timeout'],
+            )
+        log.debug("%s: Webhook response: %s", service_name, response.content)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:  # this catches all exceptions from requests
+        log.warning(f"{service_name}: Could not trigger webhook. The Exception: {short_msg(e)}")
+        log.debug("%s: The Exception: %s", service_name, e)
+        return False
+    return True
+
+
+class Dispatcher():
+    """
+    Sends the webhooks from a bounded queue with `workers` background threads. Every host gets its own keep-alive
+    session. Failed webhooks are retried `cioban.webhook.retry.count` times, doubling the wait each time, starting
+    with `cioban.webhook.retry.backoff` seconds.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 100):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self.__work, name=f'cioban-webhook-{i}', daemon=True).start()
+
+    def submit(self, request: dict):
+        """ queues a prepared webhook. If the queue is full, the webhook is dropped """
         try:
-            response = action(url, auth=auth, headers=headers, timeout=timeout)
-            log.debug(f"{self.service.name}: Webhook response: {response.content}")
-        except requests.exceptions.RequestException as e:  # this catches all exceptions from requests
-            log.warning(f"{self.service.name}: Could not trigger webhook. The Exception: {short_msg(e)}")
-            log.debug(f"{self.service.name}: The Exception: {e}")
+            self.queue.put_nowait(request)
+        except queue.Full:
+            log.error(f"{request['service_name']}: Webhook queue is full. Dropping the webhook.")
+            prometheus.PROM_WEBHOOK_FAILURES.inc()
+            return
+        prometheus.PROM_WEBHOOK_QUEUE.set(self.queue.qsize())
+
+    def join(self):
+        """ waits until all the queued webhooks have been sent """
+        self.queue.join()
+
+    def __get_session(self, url: str) -> requests.Session:
+        """ returns the keep-alive session for the host of the url """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = requests.Session()
+            return self.sessions[host]
+
+    def __work(self):
+        """ sends the queued webhooks """
+        while True:
+            request = self.queue.get()
+            prometheus.PROM_WEBHOOK_QUEUE.set(self.queue.qsize())
+            session = self.__get_session(request['url'])
+            backoff = request['retry_backoff']
+            for attempt in range(request['retry_count'] + 1):
+                if attempt:
+                    log.debug("%s: Retrying the webhook in %ss (attempt %s)", request['service_name'], backoff, attempt)
+                    time.sleep(backoff)
+                    backoff *= 2
+                if send(request, session):
+                    break
+            else:
+                prometheus.PROM_WEBHOOK_FAILURES.inc()
+            self.queue.task_done()